@@ -2,7 +2,18 @@
 Основной модуль AI-агента для работы с данными кредитной симуляции.
 """
 
+import asyncio
+import hashlib
 import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import islice
 from typing import Optional, List, Dict, Any
 from pathlib import Path
 
@@ -10,12 +21,282 @@ from langchain_community.agent_toolkits.sql.base import create_sql_agent
 from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
 from langchain_community.utilities import SQLDatabase
 from langchain.agents import AgentType
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.tools import Tool
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
-from sqlalchemy import create_engine, text
+import httpx
+from sqlalchemy import create_engine, event, text
 
 from config import AgentConfig
 from logging_utils import log_agent_interaction, log_sql_event
+from semantic_cache import (
+    PlanCache,
+    SemanticCache,
+    configure_embed_cache,
+    embed_cache_info,
+    encoder_available,
+    set_embedding_backend,
+)
+from schema_retriever import SchemaContextRetriever
+from canonical import CanonicalQueryRouter
+
+
+class BudgetExceeded(Exception):
+    """Превышен токен-бюджет запроса."""
+
+    def __init__(self, partial: str, tokens: int):
+        super().__init__(f"Превышен токен-бюджет: {tokens} токенов")
+        self.partial = partial
+        self.tokens = tokens
+
+
+class TokenBudgetHandler(BaseCallbackHandler):
+    """
+    Считает стриминговые токены и прерывает генерацию при превышении бюджета.
+
+    Ограничивает худший случай по токенам (= стоимости), а не по секундам
+    стенного времени, и накапливает частичный ответ для возврата.
+    """
+
+    # Без raise_error langchain глотает исключение из колбэка и только
+    # логирует его - BudgetExceeded обязан долететь до query()
+    raise_error = True
+
+    def __init__(self, max_total: int):
+        self.max_total = max_total
+        self.tokens = 0
+        self._parts: List[str] = []
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        self.tokens += 1
+        self._parts.append(token)
+        if self.max_total and self.tokens > self.max_total:
+            raise BudgetExceeded("".join(self._parts), self.tokens)
+
+
+class _SQLCaptureHandler(BaseCallbackHandler):
+    """Callback-обработчик: запоминает последний SQL инструмента sql_db_query."""
+
+    def __init__(self):
+        self.last_sql: Optional[str] = None
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        if serialized and serialized.get("name") == "sql_db_query":
+            self.last_sql = input_str
+
+
+class _TokenStreamHandler(BaseCallbackHandler):
+    """Callback-обработчик: передает стриминговые токены LLM в очередь."""
+
+    def __init__(self, out: "queue.Queue"):
+        self.out = out
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.out.put(token)
+
+
+# DDL-операторы, после которых схемный кэш должен быть сброшен
+_DDL_RE = re.compile(r"^\s*(CREATE|ALTER|DROP)\b", re.IGNORECASE)
+
+# Запросы только на чтение - кандидаты в кэш результатов run_raw_sql
+_SELECT_RE = re.compile(r"^\s*(SELECT|WITH|PRAGMA|EXPLAIN)\b", re.IGNORECASE)
+_PRAGMA_RE = re.compile(r"^\s*PRAGMA\b", re.IGNORECASE)
+
+# Размер кэша результатов и TTL для PRAGMA-интроспекции (схема статична
+# в рамках запуска, поэтому TTL на порядок длиннее обычного)
+_RAW_SQL_CACHE_MAX = 256
+_PRAGMA_TTL_S = 3600.0
+
+# Каталог канонических вопросов: кортеж на уровне модуля (не пересоздается
+# на каждый вызов), строки интернированы для быстрых сравнений ключей
+EXAMPLE_QUESTIONS: tuple = tuple(sys.intern(q) for q in [
+    # Общая статистика
+    "Сколько всего кредитов в базе данных?",
+    "Какой период данных в базе?",
+    "Какой общий объем выдач в рублях?",
+    "Какой средний размер кредита?",
+    "Какая средняя процентная ставка?",
+
+    # Анализ выдач
+    "Покажи топ-5 месяцев по объему выдач",
+    "Как менялся объем выдач по годам?",
+    "Какая сезонность в выдачах по месяцам года?",
+    "Какая динамика среднего чека по месяцам?",
+    "Какая динамика процентных ставок по месяцам?",
+
+    # Риск-метрики
+    "Какая доля портфеля находится в просрочке 30+ дней?",
+    "Покажи распределение кредитов по DPD бакетам",
+    "Какая динамика PAR30 по месяцам?",
+    "Какой PAR60 и PAR90 на последнюю дату?",
+    "Сколько кредитов в дефолте?",
+
+    # IFRS9
+    "Покажи IFRS9 stage mix на последнюю дату",
+    "Как менялся stage mix по месяцам в 2014-2015?",
+
+    # Макроэкономика
+    "Как менялась ставка ЦБ по годам?",
+    "Какая корреляция между ставкой ЦБ и объемом выдач?",
+    "Как влияла безработица на просрочку?",
+    "Покажи макропоказатели в период кризиса 2014-2015",
+
+    # Платежи
+    "Какое соотношение фактических и плановых платежей?",
+    "Сколько кредитов было закрыто досрочно?",
+    "Какой средний фактический платеж по месяцам?",
+
+    # Vintage analysis
+    "Покажи vintage analysis для когорт 2010 года",
+    "Какие когорты показали худшую просрочку?",
+    "Какой средний MOB для дефолтных кредитов?",
+    "Сравни качество когорт 2010 и 2014 годов",
+
+    # Продукты
+    "Какое распределение выдач по типам продуктов?",
+    "Какой продукт показывает лучшее качество?",
+
+    # Cure и Default rates
+    "Какой cure rate за последний год?",
+    "Какой default rate по когортам?",
+    "Сколько кредитов вернулось из просрочки в current?"
+])
+
+# Кэши тяжелых построений: повторное создание CreditSimulationAgent
+# (перезапуск CLI-цикла, rerun Streamlit) сводится к словарному поиску
+# вместо ре-инстанцирования LLM, toolkit и SQL-агента.
+
+# API-ключи храним отдельно: в ключ lru_cache попадает только SHA-256
+_API_KEYS: Dict[str, Optional[str]] = {}
+
+
+def _api_key_ref(api_key: Optional[str]) -> str:
+    """Зарегистрировать API-ключ и вернуть его SHA-256 для ключа кэша."""
+    digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    _API_KEYS[digest] = api_key
+    return digest
+
+
+@lru_cache(maxsize=4)
+def _build_engine(db_uri: str, echo: bool):
+    """
+    Общий engine на каждый db_uri: пул соединений переиспользуется.
+
+    Включен кэш скомпилированных запросов (агент многократно повторяет
+    одни и те же интроспекционные запросы), а на каждом соединении
+    выставляются SQLite-прагмы для чтения исторического датасета:
+    WAL, ослабленный synchronous, 64MB page cache и 256MB mmap.
+    """
+    engine = create_engine(
+        db_uri,
+        echo=echo,
+        query_cache_size=1200,
+        pool_pre_ping=True,
+        connect_args={"check_same_thread": False},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.close()
+
+    return engine
+
+
+@lru_cache(maxsize=1)
+def _get_http_client() -> httpx.Client:
+    """
+    Общий HTTP-клиент с пулом keep-alive соединений для всех провайдеров.
+
+    TLS-рукопожатие и TCP-setup платятся один раз на соединение, а не на
+    каждый экземпляр LLM; HTTP/2 включается при наличии пакета h2.
+    """
+    limits = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+    timeout = httpx.Timeout(30.0, connect=5.0)
+    try:
+        return httpx.Client(http2=True, limits=limits, timeout=timeout)
+    except ImportError:
+        return httpx.Client(limits=limits, timeout=timeout)
+
+
+@lru_cache(maxsize=4)
+def _build_llm(provider: str, model: str, temperature: float,
+               max_tokens: int, api_key_hash: str):
+    """Создать (или вернуть из кэша) языковую модель по параметрам."""
+    api_key = _API_KEYS[api_key_hash]
+    if provider == "openai":
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            api_key=api_key,
+            streaming=True,
+            http_client=_get_http_client()
+        )
+    if provider == "anthropic":
+        kwargs = dict(
+            model=model,
+            temperature=temperature,
+            api_key=api_key,
+            streaming=True,
+        )
+        try:
+            # http_client поддерживается не всеми версиями langchain-anthropic
+            return ChatAnthropic(http_client=_get_http_client(), **kwargs)
+        except Exception:
+            return ChatAnthropic(**kwargs)
+    raise ValueError(f"Неизвестный провайдер: {provider}")
+
+
+@lru_cache(maxsize=1)
+def _get_schema_retriever() -> SchemaContextRetriever:
+    """Общий ретривер секций DB_CONTEXT (эмбеддинги считаются один раз)."""
+    return SchemaContextRetriever(CreditSimulationAgent.DB_CONTEXT)
+
+
+@lru_cache(maxsize=4)
+def _build_agent_bundle(provider: str, model: str, temperature: float,
+                        max_tokens: int, api_key_hash: str, db_uri: str,
+                        echo: bool, verbose: bool, prefix: str, suffix: str,
+                        schema_retrieval: bool = False):
+    """Собрать (db, toolkit, agent); кэшируется по полной конфигурации."""
+    engine = _build_engine(db_uri, echo)
+    db = SQLDatabase(engine)
+    llm = _build_llm(provider, model, temperature, max_tokens, api_key_hash)
+    toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+    extra_tools = ()
+    if schema_retrieval:
+        extra_tools = (
+            Tool(
+                name="lookup_schema_context",
+                func=_get_schema_retriever().lookup,
+                description=(
+                    "Справка по схеме БД и бизнес-метрикам (PAR, IFRS9, "
+                    "vintage, cure/default, DPD-бакеты). Вход: тема или "
+                    "вопрос, выход: релевантные секции описания."
+                ),
+            ),
+        )
+    agent = create_sql_agent(
+        llm=llm,
+        toolkit=toolkit,
+        agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+        verbose=verbose,
+        prefix=prefix,
+        suffix=suffix,
+        extra_tools=extra_tools,
+        max_iterations=15,
+        max_execution_time=120,
+        early_stopping_method="generate",
+        handle_parsing_errors=True
+    )
+    return db, toolkit, agent
 
 
 class CreditSimulationAgent:
@@ -217,57 +498,300 @@ class CreditSimulationAgent:
         
         self.logger.info(f"Инициализация AI-агента (provider={config.llm_provider})")
         
-        # Проверка существования БД
-        if not Path(config.db_path).exists():
+        # Проверка существования БД (один os.stat, отключаемая)
+        if config.validate_db and not config.db_ready():
             raise FileNotFoundError(f"База данных не найдена: {config.db_path}")
-        
-        # Создание подключения к БД
-        db_uri = f"sqlite:///{config.db_path}"
-        self.engine = create_engine(db_uri, echo=config.verbose)
-        self.db = SQLDatabase(self.engine)
-        
+
+        # Создание подключения к БД (engine кэшируется по URI)
+        self._db_uri = config.get_db_uri()
+        self.engine = _build_engine(self._db_uri, config.sql_echo)
+
         self.logger.info(f"Подключение к БД: {config.db_path}")
-        
+
+        # Материализованные таблицы и индексы для аналитики дашборда
+        self._ensure_analytics_tables()
+
+        # Бэкенд эмбеддингов (ONNX int8 или PyTorch) - до создания агента,
+        # т.к. ретривер схемы и кэши используют общий энкодер
+        set_embedding_backend(config.embedding_backend, config.onnx_model_path)
+
         # Инициализация LLM
         self._init_llm()
-        
+
         # Создание SQL-агента
         self._create_agent()
-        
+
+        # Мемоизация схемной интроспекции (PRAGMA/sqlite_master)
+        self._install_schema_cache()
+
+        # Семантический кэш вопрос-ответ (опционально)
+        self._init_semantic_cache()
+
+        # Кэш результатов run_raw_sql: hash(sql) -> (ts, rows)
+        self._raw_sql_cache: OrderedDict = OrderedDict()
+
+        # Маршрутизатор канонических вопросов (PAR, stage mix и т.п.)
+        self._canonical_router = (
+            CanonicalQueryRouter() if config.canonical_queries_enabled else None
+        )
+
         self.logger.info("AI-агент успешно инициализирован")
-    
-    def _init_llm(self):
-        """Инициализировать языковую модель."""
-        if self.config.llm_provider == "openai":
-            self.logger.info(f"Инициализация OpenAI (model={self.config.openai_model})")
-            self.llm = ChatOpenAI(
-                model=self.config.openai_model,
-                temperature=self.config.openai_temperature,
-                max_tokens=self.config.openai_max_tokens,
-                api_key=self.config.get_api_key()
+
+    def _ensure_analytics_tables(self):
+        """
+        Материализовать first_default и аналитические индексы.
+
+        Vintage-запрос дашборда без этого считает MIN(CASE ...) по всей
+        истории на каждое обращение; таблица first_default(loan_id,
+        first_def_mob) переносит эту работу на момент запуска. Индексы по
+        (loan_id, MOB) и (period_month, DPD_bucket) обслуживают vintage- и
+        PAR/Stage/DPD-запросы. БД статична между прогонами ETL, поэтому
+        IF NOT EXISTS достаточно; на read-only БД шаг молча пропускается.
+        """
+        statements = (
+            "CREATE TABLE IF NOT EXISTS first_default AS "
+            "SELECT loan_id, "
+            "MIN(CASE WHEN lower(status) = 'default' THEN MOB END) AS first_def_mob "
+            "FROM credit_fact_history GROUP BY loan_id",
+            "CREATE INDEX IF NOT EXISTS ix_fd_loan "
+            "ON first_default(loan_id)",
+            "CREATE INDEX IF NOT EXISTS ix_cfh_loan_mob "
+            "ON credit_fact_history(loan_id, MOB)",
+            "CREATE INDEX IF NOT EXISTS ix_cfh_pm_bucket "
+            "ON credit_fact_history(period_month, DPD_bucket)",
+        )
+        try:
+            with self.engine.begin() as conn:
+                for stmt in statements:
+                    conn.execute(text(stmt))
+        except Exception as e:
+            self.logger.warning(
+                "Не удалось подготовить аналитические таблицы: %s", e
             )
-        elif self.config.llm_provider == "anthropic":
-            self.logger.info(f"Инициализация Anthropic (model={self.config.anthropic_model})")
-            self.llm = ChatAnthropic(
-                model=self.config.anthropic_model,
-                temperature=self.config.openai_temperature,  # Используем ту же температуру
-                api_key=self.config.get_api_key()
+
+    def _install_schema_cache(self):
+        """
+        Мемоизировать db.get_table_info с инвалидацией по mtime БД.
+
+        Агент в ReAct-цикле многократно запрашивает схему (sql_db_schema),
+        хотя она статична в рамках запуска. Ключ кэша включает mtime файла
+        БД, так что обновлённая база автоматически сбрасывает кэш.
+        """
+        # db разделяется между инстансами через фабрику - не оборачивать дважды
+        if getattr(self.db, "_schema_cache_installed", False):
+            self._schema_caches = self.db._schema_caches
+            return
+
+        orig_info = self.db.get_table_info
+        orig_info_no_throw = self.db.get_table_info_no_throw
+        db_path = self.config.db_path
+
+        def _mtime() -> float:
+            try:
+                return os.path.getmtime(db_path)
+            except OSError:
+                return 0.0
+
+        @lru_cache(maxsize=32)
+        def _cached_info(mtime, table_names):
+            return orig_info(list(table_names) if table_names else None)
+
+        @lru_cache(maxsize=32)
+        def _cached_info_no_throw(mtime, table_names):
+            return orig_info_no_throw(list(table_names) if table_names else None)
+
+        self.db.get_table_info = lambda table_names=None: _cached_info(
+            _mtime(), tuple(table_names) if table_names else None
+        )
+        self.db.get_table_info_no_throw = lambda table_names=None: _cached_info_no_throw(
+            _mtime(), tuple(table_names) if table_names else None
+        )
+        self._schema_caches = (_cached_info, _cached_info_no_throw)
+        self.db._schema_caches = self._schema_caches
+        self.db._schema_cache_installed = True
+
+    def clear_schema_cache(self) -> None:
+        """Сбросить кэш схемной интроспекции (после DDL)."""
+        for cache in self._schema_caches:
+            cache.cache_clear()
+
+    def _init_semantic_cache(self):
+        """Инициализировать семантический кэш и кэш SQL-планов."""
+        self._cache = None
+        self._plan_cache = None
+        if not (self.config.semantic_cache_enabled or self.config.plan_cache_enabled):
+            return
+        if not encoder_available():
+            self.logger.warning(
+                "Модель эмбеддингов недоступна - семантический кэш отключен"
             )
-        else:
-            raise ValueError(f"Неизвестный провайдер: {self.config.llm_provider}")
+            return
+        configure_embed_cache(self.config.embed_cache_size)
+        db_file = Path(self.config.db_path)
+        cache_path = db_file.with_name(db_file.stem + "_qcache.sqlite")
+        if self.config.semantic_cache_enabled:
+            self._cache = SemanticCache(cache_path, threshold=self.config.cache_threshold)
+            self.logger.info(f"Семантический кэш: {cache_path}")
+            if self.config.warm_cache_at_startup:
+                added = self._cache.warm(self.get_example_questions())
+                self.logger.info("Прогрев кэша: %d новых вопросов", added)
+        if self.config.plan_cache_enabled:
+            self._plan_cache = PlanCache(
+                cache_path, threshold=self.config.plan_cache_threshold
+            )
+            self.logger.info("Кэш SQL-планов включен")
+
+    def _query_canonical(self, question: str, t0: float) -> Optional[Dict[str, Any]]:
+        """
+        Попробовать ответить подготовленным каноническим SQL.
+
+        При уверенном совпадении интента ответ формируется напрямую из
+        результата запроса - ни одного LLM-вызова. При любой ошибке
+        возвращает None, и вопрос уходит обычному пути.
+        """
+        try:
+            intent = self._canonical_router.match(question)
+            if intent is None:
+                return None
+            answer = self._canonical_router.execute(intent, self.engine)
+        except Exception as e:
+            self.logger.warning("Канонический маршрут: ошибка, полный агент: %s", e)
+            return None
+        dt = (time.perf_counter() - t0) * 1000.0
+        self.logger.info("Канонический запрос '%s' (%.0f ms)", intent, dt)
+        log_agent_interaction(
+            self.config.history_file,
+            question=question,
+            success=True,
+            answer=answer,
+            latency_ms=dt,
+            extra={"canonical": intent},
+        )
+        return {
+            "success": True,
+            "question": question,
+            "answer": answer,
+            "error": None
+        }
+
+    def _query_from_cached_plan(self, question: str, t0: float) -> Optional[Dict[str, Any]]:
+        """
+        Попробовать ответить по закэшированному SQL-плану.
+
+        Выполняет сохранённый SQL напрямую и делает один LLM-вызов для
+        формулировки ответа вместо полного ReAct-цикла. При любой ошибке
+        возвращает None - вопрос уйдет обычному агенту.
+        """
+        hit = self._plan_cache.lookup(question)
+        if hit is None:
+            return None
+        try:
+            rows = self.db.run(hit["sql"])
+            response = self.llm.invoke(
+                f"Сформулируй ответ по данным: {rows}\nВопрос: {question}"
+            )
+            answer = getattr(response, "content", str(response))
+        except Exception as e:
+            self.logger.warning("Кэш планов: ошибка выполнения, полный агент: %s", e)
+            return None
+        dt = (time.perf_counter() - t0) * 1000.0
+        self.logger.info(
+            "Попадание в кэш SQL-планов (similarity=%s, %.0f ms)",
+            hit["similarity"], dt,
+        )
+        log_agent_interaction(
+            self.config.history_file,
+            question=question,
+            success=True,
+            answer=answer,
+            latency_ms=dt,
+            extra={"plan_cache_hit": True, "similarity": hit["similarity"]},
+        )
+        if self._cache is not None:
+            self._cache.add(question, answer)
+        return {
+            "success": True,
+            "question": question,
+            "answer": answer,
+            "error": None
+        }
+    
+    def _init_llm(self):
+        """Инициализировать языковую модель (через кэширующую фабрику)."""
+        config = self.config
+        self.logger.info(
+            f"Инициализация {config.llm_provider} (model={config.get_model_name()})"
+        )
+        # Для Anthropic используется та же температура, что и для OpenAI
+        self.llm = _build_llm(
+            config.llm_provider,
+            config.get_model_name(),
+            config.openai_temperature,
+            config.openai_max_tokens,
+            _api_key_ref(config.get_api_key()),
+        )
     
     def _create_agent(self):
-        """Создать SQL-агента."""
-        # Создание toolkit
-        self.toolkit = SQLDatabaseToolkit(db=self.db, llm=self.llm)
-        
-        # Промпт с контекстом
-        prefix = f"""
+        """Создать SQL-агента (через кэширующую фабрику)."""
+        # Ретривер схемы: вместо всего DB_CONTEXT в промпте - инструмент,
+        # подтягивающий только релевантные секции по мере необходимости
+        use_schema_retrieval = (
+            self.config.schema_retrieval_enabled and encoder_available()
+        )
+
+        if use_schema_retrieval:
+            prefix = """
+        Ты - эксперт по анализу данных кредитного портфеля банка NCL.
+        База SQLite с кредитами 2010-2015 годов, таблицы: loan_issue (выдачи),
+        credit_fact_history (помесячный операционный факт), macro_params_log
+        (макропоказатели).
+
+        Детали схемы и бизнес-метрик (PAR, IFRS9 stage mix, vintage,
+        cure/default, DPD-бакеты) запрашивай инструментом
+        lookup_schema_context только когда они нужны для текущего шага.
+
+        Важные правила:
+        - Проверяй схему таблиц перед запросом (sql_db_schema)
+        - Для дат используй формат YYYY-MM-DD
+        - Округляй числа до 2 знаков, для процентов умножай на 100
+        - Отвечай ТОЛЬКО на русском языке
+        - Проверяй результаты на пустоту и NULL
+        """
+        else:
+            prefix = self._full_prefix()
+
+        # Суффикс минимален: порядок действий уже описан в префиксе и
+        # повторялся бы на каждой итерации ReAct-цикла
+        suffix = """
+        Вопрос пользователя: {input}
+
+        Ход рассуждений: {agent_scratchpad}
+        """
+
+        # Создание агента (db/toolkit/agent кэшируются по конфигурации)
+        config = self.config
+        self.db, self.toolkit, self.agent = _build_agent_bundle(
+            config.llm_provider,
+            config.get_model_name(),
+            config.openai_temperature,
+            config.openai_max_tokens,
+            _api_key_ref(config.get_api_key()),
+            self._db_uri,
+            config.sql_echo,
+            config.verbose,
+            prefix,
+            suffix,
+            use_schema_retrieval,
+        )
+
+    def _full_prefix(self) -> str:
+        """Полный промпт-префикс со встроенным DB_CONTEXT (без ретривера)."""
+        return f"""
         Ты - эксперт по анализу данных кредитного портфеля банка NCL.
         У тебя есть доступ к базе данных с информацией о кредитах, выданных с 2010 по 2015 год.
-        
+
         {self.DB_CONTEXT}
-        
+
         Твоя задача:
         1. Понять вопрос пользователя о кредитном портфеле
         2. Составить корректный SQL-запрос к SQLite базе данных
@@ -283,49 +807,19 @@ class CreditSimulationAgent:
         - Отвечай ТОЛЬКО на русском языке
         - Если не уверен в структуре - сначала проверь схему таблицы
         - Проверяй результаты на пустоту и NULL
-        
-        Примеры хороших ответов:
-        - "В базе данных 50,432 кредита. Период: 2010-01-01 до 2015-12-31."
-        - "PAR30 на декабрь 2015 составил 8.3%, что на 2.1% выше, чем год назад."
-        - "Топ-3 месяца по выдачам: май 2013 (2.5 млрд руб), июнь 2013 (2.4 млрд), апрель 2013 (2.3 млрд)"
-        
+
         Если запрос вернул пустой результат - сообщи об этом явно и предложи альтернативу.
         """
-        
-        suffix = """
-        Начинаем! Помни порядок: 
-        1. Проверь схему таблиц
-        2. Составь SQL
-        3. Выполни запрос
-        4. Проанализируй результат
-        5. Дай понятный ответ на русском языке
-        
-        Вопрос пользователя: {input}
-        
-        Ход рассуждений: {agent_scratchpad}
-        """
-        
-        # Создание агента
-        self.agent = create_sql_agent(
-            llm=self.llm,
-            toolkit=self.toolkit,
-            agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-            verbose=self.config.verbose,
-            prefix=prefix,
-            suffix=suffix,
-            max_iterations=15,
-            max_execution_time=120,
-            early_stopping_method="generate",
-            handle_parsing_errors=True
-        )
-    
-    def query(self, question: str) -> Dict[str, Any]:
+
+    def query(self, question: str,
+              extra_callbacks: Optional[List] = None) -> Dict[str, Any]:
         """
-        Задать вопрос агенту.
-        
+        Задать вопрос агенту (синхронная обертка над aquery).
+
         Args:
             question: Вопрос на естественном языке
-            
+            extra_callbacks: Дополнительные callback-обработчики LangChain
+
         Returns:
             Словарь с результатами:
             - success: bool - успешность выполнения
@@ -333,14 +827,131 @@ class CreditSimulationAgent:
             - answer: str - ответ агента
             - error: Optional[str] - текст ошибки если была
         """
-        self.logger.info(f"Получен вопрос: {question}")
-        import time
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aquery(question, extra_callbacks))
+        raise RuntimeError(
+            "query() вызван внутри работающего event loop - "
+            "используйте await agent.aquery(question)"
+        )
+
+    def stream(self, question: str,
+               result: Optional[Dict[str, Any]] = None):
+        """
+        Задать вопрос и отдавать ответ по мере генерации.
+
+        Генератор строк: стриминговые токены LLM по мере прихода; для
+        попаданий в кэш и канонических ответов - готовый ответ одним
+        фрагментом. У ReAct-агента в поток попадают и промежуточные
+        рассуждения - интерфейс рассчитан на интерактивный чат, где
+        видимый прогресс важнее чистоты вывода.
+
+        Args:
+            question: Вопрос на естественном языке
+            result: Необязательный словарь: после исчерпания генератора
+                в нем лежит итог query() (success/answer/error) - чистый
+                финальный ответ без промежуточного scratchpad
+        """
+        out: "queue.Queue" = queue.Queue()
+        handler = _TokenStreamHandler(out)
+        if result is None:
+            result = {}
+
+        def run():
+            try:
+                result.update(self.query(question, extra_callbacks=[handler]))
+            except Exception as e:
+                result.update({"success": False, "answer": None, "error": str(e)})
+            finally:
+                out.put(None)
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        streamed = False
+        while True:
+            token = out.get()
+            if token is None:
+                break
+            streamed = True
+            yield token
+        worker.join()
+        if not streamed:
+            if result.get("answer"):
+                yield result["answer"]
+            elif result.get("error"):
+                yield f"Ошибка: {result['error']}"
+
+    async def aquery(self, question: str,
+                     extra_callbacks: Optional[List] = None) -> Dict[str, Any]:
+        """
+        Задать вопрос агенту асинхронно.
+
+        Сетевые вызовы LLM не блокируют event loop (agent.ainvoke),
+        а обращения к sqlite-кэшам уходят в пул потоков - несколько
+        параллельных вопросов перекрываются по времени ожидания провайдера.
+
+        Args:
+            question: Вопрос на естественном языке
+            extra_callbacks: Дополнительные callback-обработчики LangChain
+
+        Returns:
+            Словарь с результатами (тот же формат, что у query)
+        """
+        self.logger.info("Получен вопрос: %s", question)
         t0 = time.perf_counter()
+
+        # Поиск семантически похожего вопроса в кэше
+        if self._cache is not None:
+            hit = await asyncio.to_thread(self._cache.lookup, question)
+            if hit is not None:
+                dt = (time.perf_counter() - t0) * 1000.0
+                self.logger.info(
+                    "Попадание в семантический кэш (similarity=%s, %.0f ms)",
+                    hit["similarity"], dt,
+                )
+                log_agent_interaction(
+                    self.config.history_file,
+                    question=question,
+                    success=True,
+                    answer=hit["answer"],
+                    latency_ms=dt,
+                    extra={"cache_hit": True, "similarity": hit["similarity"]},
+                )
+                return {
+                    "success": True,
+                    "question": question,
+                    "answer": hit["answer"],
+                    "error": None
+                }
+
+        # Канонический вопрос: подготовленный SQL без LLM-планирования
+        if self._canonical_router is not None:
+            result = await asyncio.to_thread(self._query_canonical, question, t0)
+            if result is not None:
+                return result
+
+        # Похожий вопрос с известным SQL-планом: пропускаем планирование
+        if self._plan_cache is not None:
+            result = await asyncio.to_thread(
+                self._query_from_cached_plan, question, t0
+            )
+            if result is not None:
+                return result
+
+        sql_capture = _SQLCaptureHandler()
+        budget = TokenBudgetHandler(self.config.token_budget)
+        callbacks = [sql_capture, budget] + list(extra_callbacks or ())
         try:
-            response = self.agent.invoke({"input": question})
+            response = await self.agent.ainvoke(
+                {"input": question}, {"callbacks": callbacks}
+            )
             answer = response.get("output", "")
             dt = (time.perf_counter() - t0) * 1000.0
-            self.logger.info(f"Ответ получен успешно (длина: {len(answer)} символов, {dt:.0f} ms)")
+            self.logger.info(
+                "Ответ получен успешно (длина: %d символов, %.0f ms)",
+                len(answer), dt,
+            )
             # JSONL лог
             log_agent_interaction(
                 self.config.history_file,
@@ -348,16 +959,45 @@ class CreditSimulationAgent:
                 success=True,
                 answer=answer,
                 latency_ms=dt,
+                extra={"cache_hit": False, "tokens": budget.tokens},
             )
+            if self._cache is not None:
+                await asyncio.to_thread(self._cache.add, question, answer)
+            if self._plan_cache is not None and sql_capture.last_sql:
+                await asyncio.to_thread(
+                    self._plan_cache.add, question, sql_capture.last_sql
+                )
             return {
                 "success": True,
                 "question": question,
                 "answer": answer,
-                "error": None
+                "error": None,
+                "tokens": budget.tokens
+            }
+        except BudgetExceeded as e:
+            dt = (time.perf_counter() - t0) * 1000.0
+            self.logger.warning(
+                "Токен-бюджет исчерпан (%d токенов, %.0f ms)", e.tokens, dt
+            )
+            log_agent_interaction(
+                self.config.history_file,
+                question=question,
+                success=False,
+                answer=e.partial,
+                error=str(e),
+                latency_ms=dt,
+                extra={"tokens": e.tokens, "budget_exceeded": True},
+            )
+            return {
+                "success": False,
+                "question": question,
+                "answer": e.partial,
+                "error": str(e),
+                "tokens": e.tokens
             }
         except Exception as e:
             dt = (time.perf_counter() - t0) * 1000.0
-            self.logger.error(f"Ошибка при обработке вопроса: {e}", exc_info=True)
+            self.logger.error("Ошибка при обработке вопроса: %s", e, exc_info=True)
             log_agent_interaction(
                 self.config.history_file,
                 question=question,
@@ -386,36 +1026,85 @@ class CreditSimulationAgent:
             return self.db.get_table_info_no_throw([table_name])
         return self.db.get_table_info()
     
-    def run_raw_sql(self, sql: str) -> Any:
+    def run_raw_sql(self, sql: str) -> List[tuple]:
         """
         Выполнить сырой SQL-запрос (для отладки и прямых запросов).
-        
+
+        Результат читается потоково батчами по 1000 строк, а не целиком:
+        память O(батч), первая строка доступна сразу. Вывод ограничен
+        config.max_raw_sql_rows строк (усечение помечается в логе).
+
         Args:
             sql: SQL-запрос
-            
+
         Returns:
-            Результат выполнения запроса
+            Список кортежей-строк (возможно усеченный)
         """
-        self.logger.debug(f"Выполнение raw SQL: {sql}")
-        import time
+        self.logger.debug("Выполнение raw SQL: %s", sql)
+        if _DDL_RE.match(sql):
+            self.clear_schema_cache()
+
+        # Кэш точных повторов для read-only запросов (агент в ReAct-цикле
+        # многократно шлет одну и ту же интроспекцию)
+        readonly = _SELECT_RE.match(sql) is not None
+        if not readonly:
+            self._raw_sql_cache.clear()
+        key = hash(sql.strip())
+        if readonly:
+            entry = self._raw_sql_cache.get(key)
+            if entry is not None:
+                ts, cached_rows = entry
+                ttl = _PRAGMA_TTL_S if _PRAGMA_RE.match(sql) else self.config.sql_cache_ttl
+                if time.monotonic() - ts < ttl:
+                    self._raw_sql_cache.move_to_end(key)
+                    log_sql_event(
+                        self.config.history_file,
+                        name="raw_sql",
+                        sql=sql,
+                        success=True,
+                        rowcount=len(cached_rows),
+                        duration_ms=0.0,
+                        extra={"cache_hit": True},
+                    )
+                    return list(cached_rows)
+                del self._raw_sql_cache[key]
+
+        max_rows = self.config.max_raw_sql_rows
         t0 = time.perf_counter()
         try:
-            result = self.db.run(sql)
-            rows = len(result) if result else 0
+            with self.engine.begin() as conn:
+                result = conn.execution_options(
+                    stream_results=True, yield_per=1000
+                ).execute(text(sql))
+                if result.returns_rows:
+                    rows = [tuple(r) for r in islice(result, max_rows + 1)]
+                else:
+                    rows = []
+            truncated = len(rows) > max_rows
+            if truncated:
+                rows = rows[:max_rows]
             dt = (time.perf_counter() - t0) * 1000.0
-            self.logger.debug(f"SQL выполнен успешно, строк: {rows}, {dt:.0f} ms")
+            self.logger.debug(
+                "SQL выполнен успешно, строк: %d%s, %.0f ms",
+                len(rows), " (усечено)" if truncated else "", dt,
+            )
             log_sql_event(
                 self.config.history_file,
                 name="raw_sql",
                 sql=sql,
                 success=True,
-                rowcount=rows,
+                rowcount=len(rows),
                 duration_ms=dt,
+                extra={"truncated": True} if truncated else None,
             )
-            return result
+            if readonly:
+                self._raw_sql_cache[key] = (time.monotonic(), rows)
+                while len(self._raw_sql_cache) > _RAW_SQL_CACHE_MAX:
+                    self._raw_sql_cache.popitem(last=False)
+            return rows
         except Exception as e:
             dt = (time.perf_counter() - t0) * 1000.0
-            self.logger.error(f"Ошибка выполнения SQL: {e}")
+            self.logger.error("Ошибка выполнения SQL: %s", e)
             log_sql_event(
                 self.config.history_file,
                 name="raw_sql",
@@ -426,66 +1115,121 @@ class CreditSimulationAgent:
                 error=str(e),
             )
             raise
-    
+
+    def iter_raw_sql(self, sql: str):
+        """
+        Выполнить сырой SQL и отдавать строки генератором.
+
+        В отличие от run_raw_sql результат не материализуется, не
+        кэшируется и не усекается: память O(батча) при любом размере
+        выборки. Путь для потребителей, которым не нужен весь список -
+        например CLI, печатающий первые 50 строк. Соединение
+        закрывается по исчерпании или close() генератора.
+        """
+        self.logger.debug("Выполнение raw SQL (stream): %s", sql)
+        if _DDL_RE.match(sql):
+            self.clear_schema_cache()
+
+        t0 = time.perf_counter()
+        count = 0
+        try:
+            with self.engine.begin() as conn:
+                result = conn.execution_options(
+                    stream_results=True, yield_per=1000
+                ).execute(text(sql))
+                if result.returns_rows:
+                    for r in result:
+                        count += 1
+                        yield tuple(r)
+        except Exception as e:
+            dt = (time.perf_counter() - t0) * 1000.0
+            self.logger.error("Ошибка выполнения SQL: %s", e)
+            log_sql_event(
+                self.config.history_file,
+                name="raw_sql",
+                sql=sql,
+                success=False,
+                rowcount=count,
+                duration_ms=dt,
+                error=str(e),
+            )
+            raise
+        else:
+            dt = (time.perf_counter() - t0) * 1000.0
+            log_sql_event(
+                self.config.history_file,
+                name="raw_sql",
+                sql=sql,
+                success=True,
+                rowcount=count,
+                duration_ms=dt,
+                extra={"streamed": True},
+            )
+
+    def run_raw_sql_many(self, sql: str, param_rows: List[Dict[str, Any]]) -> int:
+        """
+        Выполнить SQL с батчем параметров (executemany).
+
+        Args:
+            sql: SQL с именованными параметрами (:name)
+            param_rows: Список словарей параметров
+
+        Returns:
+            Количество затронутых строк
+        """
+        if _DDL_RE.match(sql):
+            self.clear_schema_cache()
+        t0 = time.perf_counter()
+        with self.engine.begin() as conn:
+            result = conn.execute(text(sql), param_rows)
+            rowcount = result.rowcount
+        dt = (time.perf_counter() - t0) * 1000.0
+        log_sql_event(
+            self.config.history_file,
+            name="raw_sql_many",
+            sql=sql,
+            success=True,
+            rowcount=rowcount,
+            duration_ms=dt,
+            extra={"param_rows": len(param_rows)},
+        )
+        return rowcount
+
+    def get_embed_cache_stats(self) -> Dict[str, int]:
+        """
+        Получить статистику LRU-кэша эмбеддингов (мониторинг hit-rate).
+
+        Returns:
+            Словарь с полями hits, misses, maxsize, currsize
+        """
+        info = embed_cache_info()
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "maxsize": info.maxsize,
+            "currsize": info.currsize,
+        }
+
     def get_example_questions(self) -> List[str]:
         """
         Получить список примеров вопросов для агента.
-        
+
         Returns:
-            Список строк с примерами вопросов
-        """
-        return [
-            # Общая статистика
-            "Сколько всего кредитов в базе данных?",
-            "Какой период данных в базе?",
-            "Какой общий объем выдач в рублях?",
-            "Какой средний размер кредита?",
-            "Какая средняя процентная ставка?",
-            
-            # Анализ выдач
-            "Покажи топ-5 месяцев по объему выдач",
-            "Как менялся объем выдач по годам?",
-            "Какая сезонность в выдачах по месяцам года?",
-            "Какая динамика среднего чека по месяцам?",
-            "Какая динамика процентных ставок по месяцам?",
-            
-            # Риск-метрики
-            "Какая доля портфеля находится в просрочке 30+ дней?",
-            "Покажи распределение кредитов по DPD бакетам",
-            "Какая динамика PAR30 по месяцам?",
-            "Какой PAR60 и PAR90 на последнюю дату?",
-            "Сколько кредитов в дефолте?",
-            
-            # IFRS9
-            "Покажи IFRS9 stage mix на последнюю дату",
-            "Как менялся stage mix по месяцам в 2014-2015?",
-            
-            # Макроэкономика
-            "Как менялась ставка ЦБ по годам?",
-            "Какая корреляция между ставкой ЦБ и объемом выдач?",
-            "Как влияла безработица на просрочку?",
-            "Покажи макропоказатели в период кризиса 2014-2015",
-            
-            # Платежи
-            "Какое соотношение фактических и плановых платежей?",
-            "Сколько кредитов было закрыто досрочно?",
-            "Какой средний фактический платеж по месяцам?",
-            
-            # Vintage analysis
-            "Покажи vintage analysis для когорт 2010 года",
-            "Какие когорты показали худшую просрочку?",
-            "Какой средний MOB для дефолтных кредитов?",
-            "Сравни качество когорт 2010 и 2014 годов",
-            
-            # Продукты
-            "Какое распределение выдач по типам продуктов?",
-            "Какой продукт показывает лучшее качество?",
-            
-            # Cure и Default rates
-            "Какой cure rate за последний год?",
-            "Какой default rate по когортам?",
-            "Сколько кредитов вернулось из просрочки в current?"
-        ]
+            Список строк с примерами вопросов (копия EXAMPLE_QUESTIONS)
+        """
+        return list(EXAMPLE_QUESTIONS)
+
+    def close(self) -> None:
+        """
+        Освободить сетевые ресурсы агента.
+
+        Закрывает общий HTTP-пул LLM-провайдеров (он разделяется между
+        экземплярами, поэтому закрывать стоит при завершении процесса,
+        а не между запросами) и сбрасывает кэш фабрики клиента.
+        """
+        if _get_http_client.cache_info().currsize:
+            _get_http_client().close()
+            _get_http_client.cache_clear()
 
 
 if __name__ == "__main__":
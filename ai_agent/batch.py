@@ -9,8 +9,17 @@
 
 import json
 import csv
+import mmap
+import re
 import argparse
+import asyncio
+import hashlib
+import html
+import os
+import sqlite3
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Any
@@ -18,112 +27,27 @@ from typing import List, Dict, Any
 from config import load_config
 from agent import CreditSimulationAgent
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:  # pragma: no cover - опциональная зависимость
+    orjson = None
+    ORJSON_AVAILABLE = False
 
-class BatchProcessor:
-    """Обработчик пакетных запросов."""
-    
-    def __init__(self, agent: CreditSimulationAgent):
-        self.agent = agent
-        self.results: List[Dict[str, Any]] = []
-    
-    def process_questions(self, questions: List[str], verbose: bool = True) -> List[Dict[str, Any]]:
-        """
-        Обработать список вопросов.
-        
-        Args:
-            questions: Список вопросов
-            verbose: Выводить прогресс
-            
-        Returns:
-            Список результатов
-        """
-        total = len(questions)
-        
-        if verbose:
-            print(f"\n📦 Обработка {total} вопросов...\n")
-        
-        for i, question in enumerate(questions, 1):
-            if verbose:
-                print(f"[{i}/{total}] {question}")
-            
-            result = self.agent.query(question)
-            result["index"] = i
-            result["timestamp"] = datetime.now().isoformat()
-            
-            self.results.append(result)
-            
-            if verbose:
-                if result["success"]:
-                    print(f"         ✅ Успешно")
-                else:
-                    error_preview = result['error'][:100] if result['error'] else "Unknown"
-                    print(f"         ❌ Ошибка: {error_preview}")
-                print()
-        
-        if verbose:
-            successful = sum(1 for r in self.results if r["success"])
-            print(f"{'='*80}")
-            print(f"✅ Обработано: {successful}/{total} успешно ({successful/total*100:.1f}%)")
-        
-        return self.results
-    
-    def save_json(self, output_file: str):
-        """Сохранить результаты в JSON."""
-        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
-        
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump({
-                "metadata": {
-                    "timestamp": datetime.now().isoformat(),
-                    "total_questions": len(self.results),
-                    "successful": sum(1 for r in self.results if r["success"]),
-                    "failed": sum(1 for r in self.results if not r["success"])
-                },
-                "results": self.results
-            }, f, ensure_ascii=False, indent=2)
-        
-        print(f"💾 JSON сохранен: {output_file}")
-    
-    def save_csv(self, output_file: str):
-        """Сохранить результаты в CSV."""
-        if not self.results:
-            return
-        
-        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
-        
-        with open(output_file, "w", encoding="utf-8", newline="") as f:
-            fieldnames = ["index", "question", "answer", "success", "error", "timestamp"]
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            writer.writeheader()
-            
-            for result in self.results:
-                writer.writerow({
-                    "index": result["index"],
-                    "question": result["question"],
-                    "answer": result.get("answer", ""),
-                    "success": result["success"],
-                    "error": result.get("error", ""),
-                    "timestamp": result["timestamp"]
-                })
-        
-        print(f"💾 CSV сохранен: {output_file}")
-    
-    def save_html(self, output_file: str):
-        """Сохранить результаты в красивый HTML отчет."""
-        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
-        
-        # Статистика
-        total = len(self.results)
-        successful = sum(1 for r in self.results if r["success"])
-        failed = total - successful
-        success_rate = (successful / total * 100) if total > 0 else 0
-        
-        html = f"""<!DOCTYPE html>
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:  # pragma: no cover - опциональная зависимость
+    ijson = None
+    IJSON_AVAILABLE = False
+
+
+_HTML_HEADER = """<!DOCTYPE html>
 <html lang="ru">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>AI Agent Batch Report - {datetime.now().strftime('%Y-%m-%d %H:%M')}</title>
+    <title>AI Agent Batch Report - {title_ts}</title>
     <style>
         * {{ margin: 0; padding: 0; box-sizing: border-box; }}
         body {{
@@ -268,7 +192,7 @@ class BatchProcessor:
 <body>
     <div class="container">
         <h1>📊 AI Agent Batch Report</h1>
-        <div class="timestamp">Сгенерировано: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}</div>
+        <div class="timestamp">Сгенерировано: {generated_ts}</div>
         
         <div class="progress-bar">
             <div class="progress-fill" style="width: {success_rate}%;">
@@ -295,42 +219,409 @@ class BatchProcessor:
             </div>
         </div>
 """
-        
-        # Вопросы и ответы
-        for result in self.results:
-            error_class = "" if result["success"] else " error"
-            status_class = "status-success" if result["success"] else "status-error"
-            status_text = "✓ Успешно" if result["success"] else "✗ Ошибка"
-            
-            html += f"""
+
+_HTML_ITEM = """
         <div class="qa-item{error_class}">
             <div class="question-header">
-                <div class="question">{result['index']}. {result['question']}</div>
+                <div class="question">{index}. {question}</div>
                 <span class="status-badge {status_class}">{status_text}</span>
             </div>
-"""
-            
-            if result["success"]:
-                answer = result.get('answer', 'Нет ответа')
-                html += f"""            <div class="answer">{answer}</div>"""
-            else:
-                error = result.get('error', 'Неизвестная ошибка')
-                html += f"""            <div class="error-text">❌ {error}</div>"""
-            
-            html += f"""
-            <div class="meta">⏱ {result['timestamp']}</div>
+{body}
+            <div class="meta">⏱ {timestamp}</div>
         </div>
 """
-        
-        html += """
+
+_HTML_ANSWER = '''            <div class="answer">{answer}</div>'''
+
+_HTML_ERROR = '''            <div class="error-text">❌ {error}</div>'''
+
+# Связанные один раз .format: в горячем цикле остается только подстановка,
+# без повторного поиска метода на строке-шаблоне
+_format_item = _HTML_ITEM.format
+_format_answer = _HTML_ANSWER.format
+_format_error = _HTML_ERROR.format
+
+_HTML_FOOTER = """
     </div>
 </body>
 </html>
 """
+
+
+# Вопрос - непустая строка, не начинающаяся с # (пробелы по краям
+# отрезает сам паттерн); один проход C-регекспа вместо strip/startswith
+# на каждую строку Python-циклом. Хвостовой \r покрывает CRLF-файлы:
+# в байтовом (?m)-режиме $ стоит только перед \n
+_QUESTION_RE = re.compile(rb"(?m)^[\t ]*([^#\s][^\n\r]*?)[\t \r]*$")
+
+_NOW_ISO = [0.0, ""]
+
+
+def _now_iso() -> str:
+    """
+    datetime.now().isoformat() с кэшем на полсекунды.
+
+    В пакете на тысячи вопросов штамп на каждый результат - это лишний
+    вызов часов ОС и новая строка; соседние результаты в пределах 500 мс
+    спокойно делят один штамп.
+    """
+    t = time.time()
+    if t - _NOW_ISO[0] > 0.5:
+        _NOW_ISO[0] = t
+        _NOW_ISO[1] = datetime.fromtimestamp(t).isoformat()
+    return _NOW_ISO[1]
+
+
+class QueryCache:
+    """
+    Персистентный кэш результатов agent.query между запусками.
+
+    Ежедневные батчи часто повторяют одни и те же вопросы дословно -
+    кэш позволяет пропустить LLM, генерацию SQL и выполнение запроса
+    целиком. Ключ - sha256 от нормализованного вопроса плюс токен
+    данных (mtime файла БД): новый ETL инвалидирует все записи.
+    Хранилище - sqlite, как у кэша эмбеддингов агента.
+    """
+
+    def __init__(self, path: str = "cache/agent_queries.sqlite", ttl: float = 86400.0):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache ("
+                "key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        # Короткоживущее соединение на операцию: get/set зовутся из
+        # потоков пула, а sqlite-соединения непереносимы между ними
+        return sqlite3.connect(self.path)
+
+    @staticmethod
+    def _key(question: str, token: str) -> str:
+        raw = f"{question.strip().lower()}|{token}".encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()
+
+    def get(self, question: str, token: str) -> Dict[str, Any]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT result, created FROM query_cache WHERE key = ?",
+                (self._key(question, token),),
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def set(self, question: str, token: str, result: Dict[str, Any]):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO query_cache (key, result, created) VALUES (?, ?, ?)",
+                (self._key(question, token),
+                 json.dumps(result, ensure_ascii=False), time.time()),
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM query_cache")
+
+
+class BatchProcessor:
+    """Обработчик пакетных запросов."""
+
+    def __init__(self, agent: CreditSimulationAgent, use_cache: bool = True):
+        self.agent = agent
+        self.results: List[Dict[str, Any]] = []
+        self.cache = QueryCache() if use_cache else None
+
+    def _data_token(self) -> str:
+        """Токен инвалидации кэша: mtime файла БД (новый ETL его сдвигает)."""
+        try:
+            return str(os.stat(self.agent.config.db_path).st_mtime_ns)
+        except OSError:
+            return "0"
+
+    def _query(self, question: str) -> Dict[str, Any]:
+        """agent.query с персистентным кэшем поверх."""
+        if self.cache is None:
+            return self.agent.query(question)
+        token = self._data_token()
+        cached = self.cache.get(question, token)
+        if cached is not None:
+            cached["from_cache"] = True
+            return cached
+        result = self.agent.query(question)
+        if result.get("success"):
+            self.cache.set(question, token, result)
+        return result
+
+    def process_questions(self, questions: List[str], verbose: bool = True,
+                          workers: int = None) -> List[Dict[str, Any]]:
+        """
+        Обработать список вопросов.
+
+        Вопросы выполняются параллельно в пуле потоков: ожидание LLM и
+        БД - это I/O, поэтому N вопросов занимают время самого долгого,
+        а не сумму. Дубликаты (с точностью до регистра и пробелов)
+        уходят к LLM один раз, ответ раскладывается по всем исходным
+        позициям. Результаты сортируются по исходному порядку.
+
+        Args:
+            questions: Список вопросов
+            verbose: Выводить прогресс
+            workers: Число потоков (по умолчанию BATCH_WORKERS или 8)
+
+        Returns:
+            Список результатов
+        """
+        total = len(questions)
+
+        # Дедупликация: один вызов LLM на уникальный нормализованный
+        # вопрос, результат веером по исходным позициям
+        unique: Dict[str, List[int]] = {}
+        first_text: Dict[str, str] = {}
+        for i, question in enumerate(questions, 1):
+            key = " ".join(question.lower().split())
+            unique.setdefault(key, []).append(i)
+            first_text.setdefault(key, question)
+
+        if workers is None:
+            workers = int(os.getenv("BATCH_WORKERS", "8"))
+        workers = max(1, min(len(unique), workers))
+
+        if verbose:
+            dup_note = f", уникальных: {len(unique)}" if len(unique) < total else ""
+            print(f"\n📦 Обработка {total} вопросов ({workers} потоков{dup_note})...\n")
+
+        batch: List[Dict[str, Any]] = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(self._query, text): key
+                for key, text in first_text.items()
+            }
+            done = 0
+            for future in as_completed(futures):
+                key = futures[future]
+                question = first_text[key]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"success": False, "question": question,
+                              "answer": None, "error": str(e)}
+                stamp = _now_iso()
+                for i in unique[key]:
+                    copy = dict(result)
+                    copy["index"] = i
+                    copy["question"] = questions[i - 1]
+                    copy["timestamp"] = stamp
+                    batch.append(copy)
+                done += len(unique[key])
+
+                if verbose:
+                    # Один write вместо трех print: меньше syscall'ов
+                    # и блокировок stdout из потоков пула
+                    if result["success"]:
+                        status = "         ✅ Успешно\n"
+                    else:
+                        error_preview = result['error'][:100] if result['error'] else "Unknown"
+                        status = f"         ❌ Ошибка: {error_preview}\n"
+                    sys.stdout.write(f"[{done}/{total}] {question}\n{status}\n")
+                    if done % 10 == 0 or done >= total:
+                        sys.stdout.flush()
+
+        batch.sort(key=lambda r: r["index"])
+        self.results.extend(batch)
+
+        if verbose:
+            successful = sum(1 for r in self.results if r["success"])
+            print(f"{'='*80}")
+            print(f"✅ Обработано: {successful}/{total} успешно ({successful/total*100:.1f}%)")
+
+        return self.results
+
+    async def aprocess_questions(self, questions: List[str], verbose: bool = True,
+                                 concurrency: int = None) -> List[Dict[str, Any]]:
+        """
+        Обработать список вопросов асинхронно.
+
+        В отличие от пула потоков, все вопросы живут в одном event loop:
+        ожидания LLM перекрываются через agent.aquery, а число
+        одновременных запросов к провайдеру ограничивает семафор.
+        Дубликаты (с точностью до регистра и пробелов) уходят к LLM
+        один раз, как и в потоковом пути: кэш их не ловит, пока они
+        летят одновременно.
+
+        Args:
+            questions: Список вопросов
+            verbose: Выводить прогресс
+            concurrency: Лимит одновременных запросов
+                (по умолчанию LLM_CONCURRENCY или 16)
+
+        Returns:
+            Список результатов
+        """
+        total = len(questions)
+
+        # Та же дедупликация, что в process_questions: один aquery на
+        # уникальный нормализованный вопрос, ответ веером по позициям
+        unique: Dict[str, List[int]] = {}
+        first_text: Dict[str, str] = {}
+        for i, question in enumerate(questions, 1):
+            key = " ".join(question.lower().split())
+            unique.setdefault(key, []).append(i)
+            first_text.setdefault(key, question)
+
+        if concurrency is None:
+            concurrency = int(os.getenv("LLM_CONCURRENCY", "16"))
+        sem = asyncio.Semaphore(max(1, concurrency))
+        progress = {"done": 0}
+
+        if verbose:
+            dup_note = f", уникальных: {len(unique)}" if len(unique) < total else ""
+            print(f"\n📦 Обработка {total} вопросов (асинхронно, лимит {concurrency}{dup_note})...\n")
+
+        async def run(key: str, question: str) -> List[Dict[str, Any]]:
+            async with sem:
+                try:
+                    token = self._data_token() if self.cache is not None else None
+                    cached = None
+                    if self.cache is not None:
+                        cached = await asyncio.to_thread(self.cache.get, question, token)
+                    if cached is not None:
+                        cached["from_cache"] = True
+                        result = cached
+                    else:
+                        result = await self.agent.aquery(question)
+                        if self.cache is not None and result.get("success"):
+                            await asyncio.to_thread(self.cache.set, question, token, result)
+                except Exception as e:
+                    result = {"success": False, "question": question,
+                              "answer": None, "error": str(e)}
+            stamp = _now_iso()
+            copies = []
+            for i in unique[key]:
+                copy = dict(result)
+                copy["index"] = i
+                copy["question"] = questions[i - 1]
+                copy["timestamp"] = stamp
+                copies.append(copy)
+
+            if verbose:
+                progress["done"] += len(unique[key])
+                done = progress["done"]
+                if result["success"]:
+                    status = "         ✅ Успешно\n"
+                else:
+                    error_preview = result['error'][:100] if result['error'] else "Unknown"
+                    status = f"         ❌ Ошибка: {error_preview}\n"
+                sys.stdout.write(f"[{done}/{total}] {question}\n{status}\n")
+                if done % 10 == 0 or done >= total:
+                    sys.stdout.flush()
+            return copies
+
+        groups = await asyncio.gather(
+            *(run(key, text) for key, text in first_text.items())
+        )
+        batch = [r for grp in groups for r in grp]
+        batch.sort(key=lambda r: r["index"])
+        self.results.extend(batch)
+
+        if verbose:
+            successful = sum(1 for r in self.results if r["success"])
+            print(f"{'='*80}")
+            print(f"✅ Обработано: {successful}/{total} успешно ({successful/total*100:.1f}%)")
+
+        return self.results
+
+    def save_json(self, output_file: str):
+        """Сохранить результаты в JSON."""
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+
+        payload = {
+            "metadata": {
+                "timestamp": datetime.now().isoformat(),
+                "total_questions": len(self.results),
+                "successful": sum(1 for r in self.results if r["success"]),
+                "failed": sum(1 for r in self.results if not r["success"])
+            },
+            "results": self.results
+        }
+
+        # orjson сериализует в C и сразу в bytes; stdlib json с indent
+        # особенно медленный. Фолбэк - прежний json.dump
+        if ORJSON_AVAILABLE:
+            Path(output_file).write_bytes(
+                orjson.dumps(payload, option=orjson.OPT_INDENT_2)
+            )
+        else:
+            with open(output_file, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, indent=2)
+
+        print(f"💾 JSON сохранен: {output_file}")
+    
+    def save_csv(self, output_file: str):
+        """Сохранить результаты в CSV."""
+        if not self.results:
+            return
         
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(html)
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
         
+        with open(output_file, "w", encoding="utf-8", newline="") as f:
+            # csv.writer с кортежами вместо DictWriter: без промежуточного
+            # словаря и повторного поиска полей на каждой строке
+            writer = csv.writer(f)
+            writer.writerow(["index", "question", "answer", "success", "error", "timestamp"])
+            writer.writerows(
+                (r["index"], r["question"], r.get("answer", ""),
+                 r["success"], r.get("error", ""), r["timestamp"])
+                for r in self.results
+            )
+        
+        print(f"💾 CSV сохранен: {output_file}")
+    
+    def save_html(self, output_file: str):
+        """Сохранить результаты в красивый HTML отчет."""
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+
+        # Статистика
+        total = len(self.results)
+        successful = sum(1 for r in self.results if r["success"])
+        failed = total - successful
+        success_rate = (successful / total * 100) if total > 0 else 0
+
+        # Отчет пишется в файл по мере обхода результатов: конкатенация
+        # html += ... на большом отчете квадратична по копированию и
+        # держит в памяти вторую копию данных
+        now = datetime.now()
+        with open(output_file, "w", encoding="utf-8", buffering=1 << 20) as f:
+            f.write(_HTML_HEADER.format(
+                title_ts=now.strftime('%Y-%m-%d %H:%M'),
+                generated_ts=now.strftime('%d.%m.%Y %H:%M:%S'),
+                success_rate=success_rate,
+                total=total,
+                successful=successful,
+                failed=failed,
+            ))
+
+            # Вопросы/ответы приходят от пользователя и LLM - экранируем,
+            # чтобы разметка в тексте не ломала отчет
+            for result in self.results:
+                if result["success"]:
+                    body = _format_answer(answer=html.escape(str(result.get('answer') or 'Нет ответа')))
+                else:
+                    body = _format_error(error=html.escape(str(result.get('error') or 'Неизвестная ошибка')))
+                f.write(_format_item(
+                    error_class="" if result["success"] else " error",
+                    status_class="status-success" if result["success"] else "status-error",
+                    status_text="✓ Успешно" if result["success"] else "✗ Ошибка",
+                    index=result['index'],
+                    question=html.escape(str(result['question'])),
+                    body=body,
+                    timestamp=result['timestamp'],
+                ))
+
+            f.write(_HTML_FOOTER)
+
         print(f"💾 HTML сохранен: {output_file}")
 
 
@@ -348,24 +639,44 @@ def load_questions_from_file(file_path: str) -> List[str]:
         raise FileNotFoundError(f"Файл не найден: {file_path}")
     
     if path.suffix == ".txt":
-        with open(path, "r", encoding="utf-8") as f:
-            questions = [
-                line.strip() for line in f 
-                if line.strip() and not line.strip().startswith("#")
-            ]
+        # mmap отдает файл регекспу без промежуточных read: горячий цикл
+        # фильтрации комментариев уходит в движок re целиком
+        with open(path, "rb") as f:
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # пустой файл не мапится
+                return []
+            try:
+                questions = [m.decode("utf-8") for m in _QUESTION_RE.findall(mm)]
+            finally:
+                mm.close()
     
     elif path.suffix == ".json":
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                if all(isinstance(q, str) for q in data):
-                    questions = data
-                elif all(isinstance(q, dict) and "question" in q for q in data):
-                    questions = [q["question"] for q in data]
+        if IJSON_AVAILABLE:
+            # Потоковый SAX-парсер: элементы массива читаются по одному,
+            # большой корпус вопросов не материализуется целиком как
+            # дерево json.load
+            questions = []
+            with open(path, "rb") as f:
+                for item in ijson.items(f, "item"):
+                    if isinstance(item, str):
+                        questions.append(item)
+                    elif isinstance(item, dict) and "question" in item:
+                        questions.append(item["question"])
+                    else:
+                        raise ValueError("Некорректный формат JSON")
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                if isinstance(data, list):
+                    if all(isinstance(q, str) for q in data):
+                        questions = data
+                    elif all(isinstance(q, dict) and "question" in q for q in data):
+                        questions = [q["question"] for q in data]
+                    else:
+                        raise ValueError("Некорректный формат JSON")
                 else:
-                    raise ValueError("Некорректный формат JSON")
-            else:
-                raise ValueError("JSON должен содержать массив")
+                    raise ValueError("JSON должен содержать массив")
     
     else:
         raise ValueError(f"Неподдерживаемый формат файла: {path.suffix}. Используйте .txt или .json")
@@ -466,6 +777,30 @@ def main():
         default="all",
         help="Формат вывода (по умолчанию: all)"
     )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=None,
+        help="Число параллельных потоков (по умолчанию: BATCH_WORKERS или 8)"
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Асинхронный режим: один event loop вместо пула потоков "
+             "(лимит параллелизма - --workers или LLM_CONCURRENCY)"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Не использовать персистентный кэш ответов"
+    )
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="Очистить персистентный кэш ответов перед запуском"
+    )
     parser.add_argument(
         "--create-template",
         action="store_true",
@@ -488,7 +823,13 @@ def main():
     if args.create_template:
         create_default_questions_file()
         return
-    
+
+    if args.clear_cache:
+        QueryCache().clear()
+        print("🗑  Кэш ответов очищен")
+        if not args.input:
+            return
+
     # Проверка входного файла
     if not args.input:
         parser.error("Требуется --input или --create-template")
@@ -512,8 +853,12 @@ def main():
         print(f"✅ Агент готов")
         
         # Обработка вопросов
-        processor = BatchProcessor(agent)
-        processor.process_questions(questions, verbose=True)
+        processor = BatchProcessor(agent, use_cache=not args.no_cache)
+        if args.use_async:
+            asyncio.run(processor.aprocess_questions(
+                questions, verbose=True, concurrency=args.workers))
+        else:
+            processor.process_questions(questions, verbose=True, workers=args.workers)
         
         # Создание имени файла
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
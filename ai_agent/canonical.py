@@ -0,0 +1,175 @@
+"""
+Канонические аналитические запросы для AI-агента.
+
+Повторяющиеся классы вопросов (PAR30, stage mix, распределение по DPD и
+т.п.) сводятся к фиксированным подготовленным SQL-шаблонам. Вопрос
+классифицируется по косинусной близости к размеченным примерам (тот же
+MiniLM-энкодер, что у семантического кэша); при уверенном совпадении SQL
+выполняется напрямую, без LLM-планирования - остается только табличное
+форматирование ответа.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from semantic_cache import embed_question, encoder_available, get_encoder
+
+logger = logging.getLogger("ai_agent.canonical")
+
+# Порог близости для маршрутизации: строже кэша ответов - ложное
+# срабатывание здесь означает ответ не на тот вопрос
+MATCH_THRESHOLD = 0.92
+
+CANONICAL_QUERIES: Dict[str, Dict[str, Any]] = {
+    "total_loans": {
+        "title": "Всего кредитов в базе данных",
+        "examples": [
+            "Сколько всего кредитов в базе данных?",
+            "Сколько кредитов в БД?",
+        ],
+        "sql": text("SELECT COUNT(*) FROM loan_issue"),
+    },
+    "par30_timeseries": {
+        "title": "Динамика PAR30 по месяцам, %",
+        "examples": [
+            "Какая динамика PAR30 по месяцам?",
+            "Покажи PAR30 по месяцам",
+        ],
+        "sql": text("""
+            SELECT period_month,
+                   ROUND(100.0 * SUM(CASE WHEN DPD_bucket IN ('31-60','61-90','90+')
+                                          THEN balance_principal END)
+                         / NULLIF(SUM(balance_principal), 0), 2) AS par30
+            FROM credit_fact_history
+            WHERE lower(status) = 'active'
+            GROUP BY period_month
+            ORDER BY period_month
+        """),
+    },
+    "par_levels_latest": {
+        "title": "PAR30/PAR60/PAR90 на последнюю дату, %",
+        "examples": [
+            "Какой PAR60 и PAR90 на последнюю дату?",
+            "Какие уровни PAR на последний месяц?",
+        ],
+        "sql": text("""
+            SELECT period_month,
+                   ROUND(100.0 * SUM(CASE WHEN DPD_bucket IN ('31-60','61-90','90+')
+                                          THEN balance_principal END)
+                         / NULLIF(SUM(balance_principal), 0), 2) AS par30,
+                   ROUND(100.0 * SUM(CASE WHEN DPD_bucket IN ('61-90','90+')
+                                          THEN balance_principal END)
+                         / NULLIF(SUM(balance_principal), 0), 2) AS par60,
+                   ROUND(100.0 * SUM(CASE WHEN DPD_bucket = '90+'
+                                          THEN balance_principal END)
+                         / NULLIF(SUM(balance_principal), 0), 2) AS par90
+            FROM credit_fact_history
+            WHERE lower(status) = 'active'
+              AND period_month = (SELECT MAX(period_month) FROM credit_fact_history)
+            GROUP BY period_month
+        """),
+    },
+    "stage_mix_latest": {
+        "title": "IFRS9 stage mix на последнюю дату (по балансу), %",
+        "examples": [
+            "Покажи IFRS9 stage mix на последнюю дату",
+            "Какой stage mix сейчас?",
+        ],
+        "sql": text("""
+            SELECT
+                ROUND(100.0 * SUM(CASE WHEN DPD_bucket = '0'
+                                       THEN balance_principal END)
+                      / NULLIF(SUM(balance_principal), 0), 2) AS stage1,
+                ROUND(100.0 * SUM(CASE WHEN DPD_bucket IN ('1-30','31-60')
+                                       THEN balance_principal END)
+                      / NULLIF(SUM(balance_principal), 0), 2) AS stage2,
+                ROUND(100.0 * SUM(CASE WHEN DPD_bucket IN ('61-90','90+')
+                                       THEN balance_principal END)
+                      / NULLIF(SUM(balance_principal), 0), 2) AS stage3
+            FROM credit_fact_history
+            WHERE lower(status) = 'active'
+              AND period_month = (SELECT MAX(period_month) FROM credit_fact_history)
+        """),
+    },
+    "dpd_distribution": {
+        "title": "Распределение кредитов по DPD-бакетам (последняя дата)",
+        "examples": [
+            "Покажи распределение кредитов по DPD бакетам",
+            "Сколько кредитов в каждом DPD бакете?",
+        ],
+        "sql": text("""
+            SELECT DPD_bucket, COUNT(*) AS loans
+            FROM credit_fact_history
+            WHERE period_month = (SELECT MAX(period_month) FROM credit_fact_history)
+            GROUP BY DPD_bucket
+            ORDER BY DPD_bucket
+        """),
+    },
+}
+
+
+class CanonicalQueryRouter:
+    """
+    Маршрутизация вопросов в подготовленные SQL-шаблоны по эмбеддингам.
+
+    Примеры каждого интента кодируются батчем один раз; match() возвращает
+    имя интента при близости выше порога, иначе None.
+    """
+
+    def __init__(self, threshold: float = MATCH_THRESHOLD):
+        self.threshold = threshold
+        self._intents: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def _ensure_index(self) -> bool:
+        if self._matrix is not None:
+            return True
+        encoder = get_encoder()
+        if encoder is None:
+            return False
+        examples: List[str] = []
+        for intent, spec in CANONICAL_QUERIES.items():
+            for example in spec["examples"]:
+                self._intents.append(intent)
+                examples.append(example)
+        self._matrix = encoder.encode(
+            examples,
+            batch_size=32,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        ).astype(np.float32)
+        return True
+
+    def match(self, question: str) -> Optional[str]:
+        """Вернуть имя интента для вопроса или None."""
+        if not encoder_available() or not self._ensure_index():
+            return None
+        emb = embed_question(question)
+        if emb is None:
+            return None
+        sims = self._matrix @ emb
+        best = int(np.argmax(sims))
+        if float(sims[best]) < self.threshold:
+            return None
+        return self._intents[best]
+
+    def execute(self, intent: str, engine) -> str:
+        """Выполнить подготовленный SQL интента и отформатировать ответ."""
+        spec = CANONICAL_QUERIES[intent]
+        with engine.connect() as conn:
+            result = conn.execute(spec["sql"])
+            columns = list(result.keys())
+            rows = [tuple(r) for r in result]
+        lines = [spec["title"] + ":"]
+        if not rows:
+            lines.append("(нет данных)")
+        else:
+            lines.append(" | ".join(columns))
+            for row in rows[:50]:
+                lines.append(" | ".join(str(v) for v in row))
+            if len(rows) > 50:
+                lines.append(f"... и еще {len(rows) - 50} строк")
+        return "\n".join(lines)
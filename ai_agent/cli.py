@@ -5,11 +5,15 @@
 историю диалогов и дополнительные команды.
 """
 
-import os
+import atexit
+import queue
 import sys
+import threading
+import time
 import json
 import argparse
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 
@@ -20,19 +24,79 @@ try:
 except ImportError:
     HAS_COLORAMA = False
 
+# Таблица цветов строится один раз: _colored зовется десятки раз на
+# отрисовку экрана, пересоздавать dict на каждый вызов незачем
+if HAS_COLORAMA:
+    _COLORS = {
+        "red": Fore.RED,
+        "green": Fore.GREEN,
+        "yellow": Fore.YELLOW,
+        "blue": Fore.BLUE,
+        "magenta": Fore.MAGENTA,
+        "cyan": Fore.CYAN,
+        "white": Fore.WHITE
+    }
+    _RESET = Style.RESET_ALL
+else:
+    _COLORS = {}
+    _RESET = ""
+
 from config import load_config, AgentConfig
 from agent import CreditSimulationAgent
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:  # pragma: no cover - опциональная зависимость
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+try:
+    import readline
+    HAS_READLINE = True
+except ImportError:  # pragma: no cover - нет readline на Windows
+    readline = None
+    HAS_READLINE = False
+
+
+_NOW_ISO = [0.0, ""]
+
+
+def _now_iso() -> str:
+    """
+    datetime.now().isoformat() с кэшем на полсекунды.
+
+    Свежий datetime плюс форматирование на каждой реплике - лишняя
+    работа на горячем пути логирования; реплики в пределах 500 мс
+    спокойно делят один штамп (та же схема, что в batch.py).
+    """
+    t = time.time()
+    if t - _NOW_ISO[0] > 0.5:
+        _NOW_ISO[0] = t
+        _NOW_ISO[1] = datetime.fromtimestamp(t).isoformat()
+    return _NOW_ISO[1]
+
 
 class ConversationManager:
     """Менеджер истории разговоров."""
-    
+
     def __init__(self, history_file: str):
         self.history_file = Path(history_file)
         self.history_file.parent.mkdir(parents=True, exist_ok=True)
         self.current_session: List[Dict[str, Any]] = []
         self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
+        # Инкрементальные счетчики: сводка по сессии не пересчитывается
+        # тремя проходами по current_session на каждый /history
+        self._successful = 0
+        self._failed = 0
+        self._questions: List[str] = []
+        # Файл истории открывается один раз на сессию: open/close на
+        # каждую реплику - это пара лишних syscall'ов за запись. Строки
+        # копятся в 64К-буфере до flush() или выхода. Бинарный режим:
+        # orjson отдает готовые UTF-8 байты, текстовый кодек не нужен
+        self._fh = open(self.history_file, "ab", buffering=65536)
+        atexit.register(self.close)
+
     def add_interaction(
         self,
         question: str,
@@ -43,26 +107,44 @@ class ConversationManager:
         """Добавить взаимодействие в историю."""
         interaction = {
             "session_id": self.session_id,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": _now_iso(),
             "question": question,
             "answer": answer,
             "success": success,
             "error": error
         }
         self.current_session.append(interaction)
-        
-        # Сохранить в файл (JSONL format)
-        with open(self.history_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(interaction, ensure_ascii=False) + "\n")
+        self._questions.append(question)
+        if success:
+            self._successful += 1
+        else:
+            self._failed += 1
+
+        # Сохранить в файл (JSONL format, буферизованно; orjson
+        # сериализует в C сразу в bytes, фолбэк - stdlib json)
+        if ORJSON_AVAILABLE:
+            self._fh.write(orjson.dumps(interaction) + b"\n")
+        else:
+            self._fh.write(json.dumps(interaction, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def flush(self):
+        """Сбросить буфер истории на диск."""
+        if not self._fh.closed:
+            self._fh.flush()
+
+    def close(self):
+        """Закрыть файл истории (сбрасывает буфер)."""
+        if not self._fh.closed:
+            self._fh.close()
     
     def get_session_summary(self) -> Dict[str, Any]:
-        """Получить сводку по текущей сессии."""
+        """Получить сводку по текущей сессии (O(1) по счетчикам)."""
         return {
             "session_id": self.session_id,
             "total_questions": len(self.current_session),
-            "successful": sum(1 for i in self.current_session if i["success"]),
-            "failed": sum(1 for i in self.current_session if not i["success"]),
-            "questions": [i["question"] for i in self.current_session]
+            "successful": self._successful,
+            "failed": self._failed,
+            "questions": self._questions
         }
 
 
@@ -90,122 +172,206 @@ class AgentCLI:
         self.agent = agent
         self.conv_manager = conversation_manager
         self.last_answer = None
-    
+        # Ленивые кэши статического вывода: заголовок и справка не
+        # меняются в течение сессии, рендерим их один раз
+        self._header_cache = None
+        self._help_cache = None
+        # Каталог для /save создается один раз при старте, а не на
+        # каждое сохранение
+        self._output_dir = Path("outputs")
+        self._output_dir.mkdir(exist_ok=True)
+        # Фоновый писатель: /save кладет задание в очередь и сразу
+        # возвращает управление - интерактивный цикл не ждет диск
+        self._writer_q: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+        atexit.register(self._stop_writer)
+        self._setup_readline()
+        # Таблица диспетчеризации команд (см. handle_command)
+        self._dispatch = {
+            "help": self.print_help,
+            "examples": self._cmd_examples,
+            "history": self._cmd_history,
+            "tables": self._cmd_tables,
+            "stats": self.show_db_stats,
+            "sql": self._cmd_sql,
+            "save": self.save_last_answer,
+            "config": self.show_config,
+            "clear": self._cmd_clear,
+        }
+
+    def _writer_loop(self):
+        """Поток записи: пишет (path, text) задания из очереди."""
+        while True:
+            job = self._writer_q.get()
+            if job is None:
+                break
+            path, payload = job
+            try:
+                path.write_text(payload, encoding="utf-8")
+            except OSError as e:
+                print(f"\n{self._colored('❌ Ошибка записи:', 'red')} {path}: {e}")
+
+    def _stop_writer(self):
+        """Дописать очередь и остановить поток записи."""
+        self._writer_q.put(None)
+        self._writer.join(timeout=5.0)
+
+    def _setup_readline(self):
+        """
+        Подключить readline: история ввода между сессиями и
+        tab-дополнение /команд.
+
+        Редактирование строки и поиск по истории делает C-библиотека;
+        без readline (Windows) остается голый input().
+        """
+        if not HAS_READLINE:
+            return
+        history_path = Path.home() / ".config" / "loan_portfolio" / "cli_history"
+        history_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            readline.read_history_file(history_path)
+        except (FileNotFoundError, OSError):
+            pass
+        readline.set_history_length(1000)
+        atexit.register(self._save_readline_history, history_path)
+        readline.set_completer(self._completer)
+        readline.set_completer_delims(" \t\n")
+        readline.parse_and_bind("tab: complete")
+
+    @staticmethod
+    def _save_readline_history(history_path: Path):
+        try:
+            readline.write_history_file(history_path)
+        except OSError:
+            pass
+
+    def _completer(self, text: str, state: int):
+        """Дополнение /команд по tab."""
+        if not text.startswith("/"):
+            return None
+        matches = [f"/{c}" for c in self.COMMANDS if c.startswith(text[1:])]
+        return matches[state] if state < len(matches) else None
+
     def _colored(self, text: str, color: str) -> str:
         """Раскрасить текст если доступна colorama."""
-        if not HAS_COLORAMA:
-            return text
-        
-        colors = {
-            "red": Fore.RED,
-            "green": Fore.GREEN,
-            "yellow": Fore.YELLOW,
-            "blue": Fore.BLUE,
-            "magenta": Fore.MAGENTA,
-            "cyan": Fore.CYAN,
-            "white": Fore.WHITE
-        }
-        
-        return f"{colors.get(color, '')}{text}{Style.RESET_ALL}"
+        prefix = _COLORS.get(color, "")
+        return f"{prefix}{text}{_RESET}" if prefix else text
     
     def print_header(self):
-        """Вывести заголовок."""
-        print("\n" + "=" * 80)
-        print(self._colored(
-            " " * 15 + "AI-АГЕНТ ДЛЯ АНАЛИЗА КРЕДИТНОГО ПОРТФЕЛЯ NCL",
-            "cyan"
-        ))
-        print("=" * 80)
-        print(f"\n📊 База данных: {self.agent.config.db_path}")
-        print(f"🤖 LLM: {self.agent.config.llm_provider} ({self.agent.config.get_model_name()})")
-        print(f"🆔 Сессия: {self.conv_manager.session_id}")
-        print(f"\nВведите {self._colored('/help', 'yellow')} для списка команд")
-        print("-" * 80 + "\n")
-    
+        """Вывести заголовок (рендерится один раз, дальше - из кэша)."""
+        if self._header_cache is None:
+            self._header_cache = "\n".join([
+                "\n" + "=" * 80,
+                self._colored(
+                    " " * 15 + "AI-АГЕНТ ДЛЯ АНАЛИЗА КРЕДИТНОГО ПОРТФЕЛЯ NCL",
+                    "cyan"
+                ),
+                "=" * 80,
+                f"\n📊 База данных: {self.agent.config.db_path}",
+                f"🤖 LLM: {self.agent.config.llm_provider} ({self.agent.config.get_model_name()})",
+                f"🆔 Сессия: {self.conv_manager.session_id}",
+                f"\nВведите {self._colored('/help', 'yellow')} для списка команд",
+                "-" * 80 + "\n",
+            ])
+        print(self._header_cache)
+
     def print_help(self):
-        """Вывести справку."""
-        print(f"\n{self._colored('📖 Доступные команды:', 'cyan')}\n")
-        for cmd, desc in self.COMMANDS.items():
-            cmd_colored = self._colored(f"/{cmd:<12}", "yellow")
-            print(f"  {cmd_colored} - {desc}")
-        print(f"\n💡 {self._colored('Просто задавайте вопросы на естественном языке!', 'green')}")
-        print()
+        """Вывести справку (рендерится один раз, дальше - из кэша)."""
+        if self._help_cache is None:
+            lines = [f"\n{self._colored('📖 Доступные команды:', 'cyan')}\n"]
+            lines.extend(
+                f"  {self._colored(f'/{cmd:<12}', 'yellow')} - {desc}"
+                for cmd, desc in self.COMMANDS.items()
+            )
+            lines.append(
+                f"\n💡 {self._colored('Просто задавайте вопросы на естественном языке!', 'green')}\n"
+            )
+            self._help_cache = "\n".join(lines)
+        print(self._help_cache)
     
+    _EXIT_ALIASES = frozenset({"exit", "quit", "выход"})
+
     def handle_command(self, command: str) -> bool:
         """
         Обработать команду.
-        
+
+        Диспетчеризация по таблице команда -> метод вместо лестницы
+        if/elif: O(1) на команду и одно место для расширения списка.
+
         Returns:
             True если нужно продолжить, False если выход
         """
         cmd_parts = command.strip().split(maxsplit=1)
         cmd = cmd_parts[0].lower()
         args = cmd_parts[1] if len(cmd_parts) > 1 else ""
-        
-        if cmd in ["exit", "quit", "выход"]:
+
+        if cmd in self._EXIT_ALIASES:
             return False
-        
-        elif cmd == "help":
-            self.print_help()
-        
-        elif cmd == "examples":
-            print(f"\n{self._colored('📋 Примеры вопросов:', 'cyan')}\n")
-            examples = self.agent.get_example_questions()
-            # Показываем по 10 примеров с группировкой
-            groups = {
-                "Общая статистика": examples[0:5],
-                "Анализ выдач": examples[5:10],
-                "Риск-метрики": examples[10:15],
-                "IFRS9 и макроэкономика": examples[15:20],
-            }
-            for group_name, questions in groups.items():
-                print(f"  {self._colored(group_name + ':', 'yellow')}")
-                for q in questions:
-                    print(f"    • {q}")
-                print()
-        
-        elif cmd == "history":
-            summary = self.conv_manager.get_session_summary()
-            print(f"\n{self._colored('📜 История сессии', 'cyan')} {summary['session_id']}:\n")
-            print(f"  Всего вопросов: {summary['total_questions']}")
-            print(f"  Успешных: {self._colored(str(summary['successful']), 'green')}")
-            print(f"  С ошибками: {self._colored(str(summary['failed']), 'red')}")
-            if summary['questions']:
-                print("\n  Вопросы:")
-                for i, q in enumerate(summary['questions'], 1):
-                    print(f"    {i}. {q}")
-            print()
-        
-        elif cmd == "tables":
-            print(f"\n{self._colored('📁 Информация о таблицах:', 'cyan')}\n")
-            print(self.agent.get_table_info())
-            print()
-        
-        elif cmd == "stats":
-            self.show_db_stats()
-        
-        elif cmd == "sql":
-            if not args:
-                print(f"{self._colored('❌', 'red')} Использование: /sql SELECT ...")
-            else:
-                self.execute_raw_sql(args)
-        
-        elif cmd == "save":
-            self.save_last_answer()
-        
-        elif cmd == "config":
-            self.show_config()
-        
-        elif cmd == "clear":
-            os.system('cls' if os.name == 'nt' else 'clear')
-            self.print_header()
-        
-        else:
+
+        handler = self._dispatch.get(cmd)
+        if handler is None:
             print(f"{self._colored('❌', 'red')} Неизвестная команда: /{cmd}")
             print(f"Введите {self._colored('/help', 'yellow')} для списка команд")
-        
+        elif cmd == "sql":
+            handler(args)
+        else:
+            handler()
+
         return True
-    
+
+    def _cmd_examples(self):
+        """Команда /examples: примеры вопросов по группам."""
+        print(f"\n{self._colored('📋 Примеры вопросов:', 'cyan')}\n")
+        examples = self.agent.get_example_questions()
+        # Показываем по 10 примеров с группировкой
+        groups = {
+            "Общая статистика": examples[0:5],
+            "Анализ выдач": examples[5:10],
+            "Риск-метрики": examples[10:15],
+            "IFRS9 и макроэкономика": examples[15:20],
+        }
+        for group_name, questions in groups.items():
+            print(f"  {self._colored(group_name + ':', 'yellow')}")
+            for q in questions:
+                print(f"    • {q}")
+            print()
+
+    def _cmd_history(self):
+        """Команда /history: сводка по текущей сессии."""
+        summary = self.conv_manager.get_session_summary()
+        print(f"\n{self._colored('📜 История сессии', 'cyan')} {summary['session_id']}:\n")
+        print(f"  Всего вопросов: {summary['total_questions']}")
+        print(f"  Успешных: {self._colored(str(summary['successful']), 'green')}")
+        print(f"  С ошибками: {self._colored(str(summary['failed']), 'red')}")
+        if summary['questions']:
+            print("\n  Вопросы:")
+            for i, q in enumerate(summary['questions'], 1):
+                print(f"    {i}. {q}")
+        print()
+
+    def _cmd_tables(self):
+        """Команда /tables: структура таблиц БД."""
+        print(f"\n{self._colored('📁 Информация о таблицах:', 'cyan')}\n")
+        print(self.agent.get_table_info())
+        print()
+
+    def _cmd_sql(self, args: str):
+        """Команда /sql: прямой SQL-запрос."""
+        if not args:
+            print(f"{self._colored('❌', 'red')} Использование: /sql SELECT ...")
+        else:
+            self.execute_raw_sql(args)
+
+    def _cmd_clear(self):
+        """Команда /clear: очистить экран."""
+        # ANSI-последовательность вместо форка cls/clear: запись пары
+        # байт вместо запуска процесса. На Windows эскейпы транслирует
+        # colorama.init, на Win10+ VT-режим включен и так
+        sys.stdout.write("\x1b[2J\x1b[H")
+        sys.stdout.flush()
+        self.print_header()
+
     def show_config(self):
         """Показать текущую конфигурацию."""
         cfg = self.agent.config
@@ -220,41 +386,69 @@ class AgentCLI:
         print(f"  Verbose: {cfg.verbose}")
         print()
     
+    STATS_LABELS = (
+        "Всего кредитов",
+        "Период выдач",
+        "Общий объем выдач (млрд руб)",
+        "Средний чек (тыс руб)",
+        "Средняя ставка (%)",
+        "Записей в credit_fact_history",
+        "Период операционного факта",
+    )
+
+    # Все агрегаты таблицы за один скан: раздельные скалярные подзапросы
+    # заставляли SQLite перечитывать loan_issue пять раз. Форматирование
+    # (периоды, округления) уходит в Python
+    STATS_LOAN_SQL = """
+        SELECT COUNT(*), MIN(issue_date), MAX(issue_date),
+               SUM(loan_amount), AVG(loan_amount), AVG(interest_rate)
+        FROM loan_issue
+    """
+    STATS_FACT_SQL = """
+        SELECT COUNT(*), MIN(period_month), MAX(period_month)
+        FROM credit_fact_history
+    """
+
     def show_db_stats(self):
         """Показать быструю статистику БД."""
         print(f"\n{self._colored('📊 Статистика базы данных:', 'cyan')}\n")
-        
-        stats_queries = [
-            ("Всего кредитов", "SELECT COUNT(*) FROM loan_issue"),
-            ("Период выдач", "SELECT MIN(issue_date) || ' - ' || MAX(issue_date) FROM loan_issue"),
-            ("Общий объем выдач (млрд руб)", "SELECT ROUND(SUM(loan_amount)/1000000000.0, 2) FROM loan_issue"),
-            ("Средний чек (тыс руб)", "SELECT ROUND(AVG(loan_amount)/1000.0, 2) FROM loan_issue"),
-            ("Средняя ставка (%)", "SELECT ROUND(AVG(interest_rate), 2) FROM loan_issue"),
-            ("Записей в credit_fact_history", "SELECT COUNT(*) FROM credit_fact_history"),
-            ("Период операционного факта", "SELECT MIN(period_month) || ' - ' || MAX(period_month) FROM credit_fact_history")
-        ]
-        
-        for label, sql in stats_queries:
-            try:
-                result = self.agent.run_raw_sql(sql)
-                value = result[0][0] if result and result[0] else "N/A"
+
+        try:
+            n, mn, mx, total, avg, rate = self.agent.run_raw_sql(self.STATS_LOAN_SQL)[0]
+            fact_n, fact_mn, fact_mx = self.agent.run_raw_sql(self.STATS_FACT_SQL)[0]
+            values = (
+                n,
+                f"{mn} - {mx}" if mn is not None else None,
+                round(total / 1e9, 2) if total is not None else None,
+                round(avg / 1e3, 2) if avg is not None else None,
+                round(rate, 2) if rate is not None else None,
+                fact_n,
+                f"{fact_mn} - {fact_mx}" if fact_mn is not None else None,
+            )
+            for label, value in zip(self.STATS_LABELS, values):
+                value = value if value is not None else "N/A"
                 print(f"  {label}: {self._colored(str(value), 'green')}")
-            except Exception as e:
-                print(f"  {label}: {self._colored(f'Ошибка - {e}', 'red')}")
+        except Exception as e:
+            print(f"  {self._colored(f'Ошибка - {e}', 'red')}")
         print()
     
     def execute_raw_sql(self, sql: str):
         """Выполнить прямой SQL."""
         print(f"\n{self._colored('🔧 Выполняю SQL:', 'cyan')}\n{sql}\n")
         try:
-            result = self.agent.run_raw_sql(sql)
-            if result:
+            # Потоковый путь: показываем первые 50 строк из генератора,
+            # остаток только пересчитываем - весь результат в память
+            # не материализуется
+            it = self.agent.iter_raw_sql(sql)
+            shown = list(islice(it, 50))
+            if shown:
                 print(f"{self._colored('📋 Результат:', 'cyan')}\n")
-                for i, row in enumerate(result[:50], 1):  # Показываем первые 50 строк
+                for i, row in enumerate(shown, 1):
                     print(f"  {i}. {row}")
-                if len(result) > 50:
-                    print(f"\n  {self._colored(f'... и еще {len(result) - 50} строк', 'yellow')}")
-                print(f"\nВсего строк: {self._colored(str(len(result)), 'green')}")
+                remaining = sum(1 for _ in it)
+                if remaining:
+                    print(f"\n  {self._colored(f'... и еще {remaining} строк', 'yellow')}")
+                print(f"\nВсего строк: {self._colored(str(len(shown) + remaining), 'green')}")
             else:
                 print(f"{self._colored('✅', 'green')} Запрос выполнен успешно (нет результатов)")
         except Exception as e:
@@ -267,19 +461,19 @@ class AgentCLI:
             print(f"{self._colored('❌', 'red')} Нет ответа для сохранения")
             return
         
-        # Создать директорию outputs
-        output_dir = Path("outputs")
-        output_dir.mkdir(exist_ok=True)
-        
-        filename = output_dir / f"answer_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-        
-        with open(filename, "w", encoding="utf-8") as f:
-            f.write(f"Вопрос: {self.last_answer['question']}\n")
-            f.write(f"Время: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"\n{'='*80}\n\n")
-            f.write(f"Ответ:\n\n{self.last_answer['answer']}\n")
-        
+        now = datetime.now()
+        filename = self._output_dir / f"answer_{now.strftime('%Y%m%d_%H%M%S')}.txt"
+
+        self._writer_q.put((
+            filename,
+            f"Вопрос: {self.last_answer['question']}\n"
+            f"Время: {now.strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"\n{'='*80}\n\n"
+            f"Ответ:\n\n{self.last_answer['answer']}\n",
+        ))
+
         print(f"{self._colored('✅', 'green')} Ответ сохранен: {filename}")
+        self.conv_manager.flush()
     
     def process_question(self, question: str):
         """Обработать вопрос пользователя."""
@@ -307,33 +501,37 @@ class AgentCLI:
         """Запустить интерактивный режим."""
         self.print_header()
         
-        while True:
-            try:
-                user_input = input(f"{self._colored('❓', 'cyan')} Вопрос или команда: ").strip()
-                
-                if not user_input:
-                    continue
+        try:
+            while True:
+                try:
+                    user_input = input(f"{self._colored('❓', 'cyan')} Вопрос или команда: ").strip()
                 
-                # Команда начинается с /
-                if user_input.startswith("/"):
-                    if not self.handle_command(user_input[1:]):
+                    if not user_input:
+                        continue
+
+                    # Команда начинается с /
+                    if user_input.startswith("/"):
+                        if not self.handle_command(user_input[1:]):
+                            break
+                    # Специальные слова для выхода
+                    elif user_input.lower() in ['exit', 'quit', 'выход']:
                         break
-                # Специальные слова для выхода
-                elif user_input.lower() in ['exit', 'quit', 'выход']:
+                    # Обычный вопрос
+                    else:
+                        self.process_question(user_input)
+
+                except KeyboardInterrupt:
+                    print("\n")
                     break
-                # Обычный вопрос
-                else:
-                    self.process_question(user_input)
-            
-            except KeyboardInterrupt:
-                print("\n")
-                break
-            except EOFError:
-                print("\n")
-                break
-            except Exception as e:
-                print(f"\n{self._colored('❌ Непредвиденная ошибка:', 'red')} {e}\n")
-        
+                except EOFError:
+                    print("\n")
+                    break
+                except Exception as e:
+                    print(f"\n{self._colored('❌ Непредвиденная ошибка:', 'red')} {e}\n")
+        finally:
+            # История пишется буферизованно - гарантируем сброс на диск
+            self.conv_manager.flush()
+
         # Показать сводку по сессии
         summary = self.conv_manager.get_session_summary()
         print(f"\n{self._colored('📊 Сводка по сессии:', 'cyan')}")
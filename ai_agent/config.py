@@ -7,7 +7,7 @@
 import os
 from pathlib import Path
 from typing import Optional, Literal
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, PrivateAttr, validator
 
 
 class AgentConfig(BaseModel):
@@ -62,6 +62,14 @@ class AgentConfig(BaseModel):
         default="../credit_sim.db",
         description="Путь к базе данных SQLite"
     )
+    validate_db: bool = Field(
+        default=True,
+        description="Проверять существование БД при создании агента"
+    )
+
+    # Кэшированные производные от db_path (URI и результат stat)
+    _db_uri: Optional[str] = PrivateAttr(default=None)
+    _db_ready: Optional[bool] = PrivateAttr(default=None)
     
     # Логирование
     log_level: str = Field(
@@ -78,11 +86,77 @@ class AgentConfig(BaseModel):
         default="logs/agent_history.jsonl",
         description="Файл истории диалогов"
     )
+
+    # Семантический кэш вопрос-ответ
+    semantic_cache_enabled: bool = Field(
+        default=True,
+        description="Включить семантический кэш (требует sentence-transformers)"
+    )
+    cache_threshold: float = Field(
+        default=0.9,
+        ge=0.0,
+        le=1.0,
+        description="Порог косинусной близости для попадания в кэш"
+    )
+    embed_cache_size: int = Field(
+        default=1024,
+        ge=0,
+        description="Размер LRU-кэша эмбеддингов (повторные вопросы)"
+    )
+    embedding_backend: Literal["auto", "torch", "onnx"] = Field(
+        default="auto",
+        description="Бэкенд эмбеддингов: ONNX int8 (если экспортирован) или PyTorch"
+    )
+    onnx_model_path: Optional[str] = Field(
+        default=None,
+        description="Путь к экспортированной ONNX int8 модели MiniLM"
+    )
+    schema_retrieval_enabled: bool = Field(
+        default=False,
+        description="Вместо DB_CONTEXT в промпте - инструмент lookup_schema_context"
+    )
+    warm_cache_at_startup: bool = Field(
+        default=False,
+        description="Прогревать семантический кэш каталогом примеров вопросов"
+    )
+    canonical_queries_enabled: bool = Field(
+        default=False,
+        description="Отвечать на канонические вопросы подготовленным SQL без LLM"
+    )
+    plan_cache_enabled: bool = Field(
+        default=False,
+        description="Переиспользовать SQL-планы для похожих вопросов"
+    )
+    plan_cache_threshold: float = Field(
+        default=0.93,
+        ge=0.0,
+        le=1.0,
+        description="Порог близости для кэша SQL-планов (строже кэша ответов)"
+    )
     
     # Режим отладки
     verbose: bool = Field(
         default=False,
-        description="Режим отладки"
+        description="Режим отладки (трассировка LangChain-агента)"
+    )
+    sql_echo: bool = Field(
+        default=False,
+        description="Логировать SQL на уровне SQLAlchemy (отдельно от verbose)"
+    )
+    max_raw_sql_rows: int = Field(
+        default=10000,
+        ge=1,
+        description="Максимум строк в результате run_raw_sql"
+    )
+    sql_cache_ttl: float = Field(
+        default=60.0,
+        ge=0.0,
+        description="TTL (сек) кэша результатов run_raw_sql для SELECT"
+    )
+    token_budget: int = Field(
+        default=0,
+        ge=0,
+        description="Лимит стриминговых токенов на запрос (0 - без лимита)"
     )
     
     class Config:
@@ -119,6 +193,26 @@ class AgentConfig(BaseModel):
         
         return str(full_path)
     
+    def get_db_uri(self) -> str:
+        """Получить SQLAlchemy URI базы данных (строится один раз)."""
+        if self._db_uri is None:
+            self._db_uri = f"sqlite:///{os.fspath(self.db_path)}"
+        return self._db_uri
+
+    def db_ready(self) -> bool:
+        """
+        Проверить, что файл БД существует и не пуст.
+
+        Один os.stat вместо Path().exists(); результат кэшируется, чтобы
+        пересоздание агента не платило за syscall повторно.
+        """
+        if self._db_ready is None:
+            try:
+                self._db_ready = os.stat(self.db_path).st_size > 0
+            except OSError:
+                self._db_ready = False
+        return self._db_ready
+
     def get_api_key(self) -> str:
         """Получить API ключ для текущего провайдера."""
         if self.llm_provider == "openai":
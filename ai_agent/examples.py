@@ -150,32 +150,47 @@ def example_batch_processing():
         "Какой средний чек?",
         "Какая средняя ставка?"
     ]
-    
+
+    # Запись уходит в фоновый поток по мере готовности результатов
+    # (JSONL): цикл вопросов не блокируется на диске, и ничего не
+    # копится в памяти до конца
+    import json
+    import queue
+    import threading
+    from datetime import datetime
+    from pathlib import Path
+
+    Path("outputs").mkdir(exist_ok=True)
+    filename = f"outputs/batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+    jobs: "queue.Queue" = queue.Queue()
+
+    def writer():
+        with open(filename, "w", encoding="utf-8") as f:
+            while True:
+                line = jobs.get()
+                if line is None:
+                    break
+                f.write(line)
+
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    writer_thread.start()
+
     results = []
     for question in questions:
         result = agent.query(question)
         results.append(result)
-    
+        jobs.put(json.dumps(result, ensure_ascii=False) + "\n")
+
+    jobs.put(None)
+    writer_thread.join()
+
     # Статистика
     successful = sum(1 for r in results if r["success"])
     print(f"\nСтатистика:")
     print(f"  Всего вопросов: {len(results)}")
     print(f"  Успешных: {successful}")
     print(f"  С ошибками: {len(results) - successful}")
-    
-    # Сохранение в JSON
-    import json
-    from datetime import datetime
-    
-    output = {
-        "timestamp": datetime.now().isoformat(),
-        "results": results
-    }
-    
-    filename = f"outputs/batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
-    
+
     print(f"\n✅ Результаты сохранены: {filename}")
 
 
@@ -1,23 +1,80 @@
+import atexit
 import json
+import queue
+import threading
 import time
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict, Any, Union
 
+# JSONL-записи пишутся фоновым потоком: горячий путь агента только кладет
+# запись в очередь, сериализация и дисковый I/O не блокируют запрос.
+_queue: "queue.Queue" = queue.Queue()
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
 
 def _ensure_parent(path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
 
 
+def _writer_loop() -> None:
+    """Фоновый писатель: один append-хэндл на файл, flush при пустой очереди."""
+    handles: Dict[Path, Any] = {}
+    while True:
+        item = _queue.get()
+        if item is None:
+            break
+        path, record = item
+        try:
+            f = handles.get(path)
+            if f is None or f.closed:
+                _ensure_parent(path)
+                f = path.open("a", encoding="utf-8")
+                handles[path] = f
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if _queue.empty():
+                f.flush()
+        except Exception:
+            # Логирование не должно ронять основной поток
+            pass
+        finally:
+            _queue.task_done()
+    for f in handles.values():
+        try:
+            f.close()
+        except Exception:
+            pass
+
+
+def _ensure_worker() -> None:
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        with _worker_lock:
+            if _worker is None or not _worker.is_alive():
+                _worker = threading.Thread(
+                    target=_writer_loop, name="jsonl-writer", daemon=True
+                )
+                _worker.start()
+
+
+def flush_jsonl(timeout: float = 5.0) -> None:
+    """Дождаться записи всех поставленных в очередь JSONL-записей."""
+    deadline = time.monotonic() + timeout
+    while not _queue.empty() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+atexit.register(flush_jsonl)
+
+
 def append_jsonl(file_path: Union[str, Path], record: Dict[str, Any]) -> None:
-    path = Path(file_path)
-    _ensure_parent(path)
     record = {
         **record,
         "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
     }
-    with path.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    _ensure_worker()
+    _queue.put((Path(file_path), record))
 
 
 def log_agent_interaction(
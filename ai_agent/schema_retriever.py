@@ -0,0 +1,98 @@
+"""
+Ретривер схемного контекста для SQL-агента.
+
+Большое описание БД (DB_CONTEXT) режется по заголовкам на секции, каждая
+секция кодируется MiniLM один раз. Вместо вставки всего контекста в промпт
+(и его повторения на каждой итерации ReAct-цикла) агент получает инструмент
+lookup_schema_context и подтягивает только релевантные 1-2 секции.
+"""
+
+import logging
+from typing import List, Optional
+
+import numpy as np
+
+from semantic_cache import get_encoder
+
+logger = logging.getLogger("ai_agent.schema_retriever")
+
+
+def split_context_sections(context: str) -> List[str]:
+    """
+    Разбить markdown-описание БД на секции по заголовкам '##'/'###'.
+
+    Args:
+        context: Текст описания (DB_CONTEXT)
+
+    Returns:
+        Список секций (заголовок + тело)
+    """
+    sections: List[str] = []
+    current: List[str] = []
+    for line in context.splitlines():
+        if line.lstrip().startswith("##"):
+            chunk = "\n".join(current).strip()
+            if chunk:
+                sections.append(chunk)
+            current = [line]
+        else:
+            current.append(line)
+    chunk = "\n".join(current).strip()
+    if chunk:
+        sections.append(chunk)
+    return sections
+
+
+class SchemaContextRetriever:
+    """
+    Поиск релевантных секций описания БД по текстовому запросу.
+
+    Секции кодируются батчем при первом обращении; поиск - скалярное
+    произведение нормированных векторов (точный, секций ~десяток).
+    """
+
+    def __init__(self, context: str, top_k: int = 2):
+        """
+        Args:
+            context: Полный текст описания БД
+            top_k: Сколько секций возвращать на запрос
+        """
+        self.sections = split_context_sections(context)
+        self.top_k = top_k
+        self._matrix: Optional[np.ndarray] = None
+
+    def _ensure_index(self) -> bool:
+        """Посчитать эмбеддинги секций (один раз). False если модели нет."""
+        if self._matrix is not None:
+            return True
+        encoder = get_encoder()
+        if encoder is None:
+            return False
+        self._matrix = encoder.encode(
+            self.sections,
+            batch_size=32,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        ).astype(np.float32)
+        return True
+
+    def lookup(self, topic: str) -> str:
+        """
+        Вернуть top-k секций, релевантных запросу.
+
+        Args:
+            topic: Тема/вопрос (например, 'PAR30' или 'структура loan_issue')
+
+        Returns:
+            Текст секций; при недоступности модели - весь контекст
+        """
+        if not self._ensure_index():
+            logger.warning("Модель эмбеддингов недоступна - возвращаю весь контекст")
+            return "\n\n".join(self.sections)
+        encoder = get_encoder()
+        emb = np.asarray(
+            encoder.encode(topic, normalize_embeddings=True), dtype=np.float32
+        )
+        sims = self._matrix @ emb
+        top = np.argsort(sims)[::-1][: self.top_k]
+        return "\n\n".join(self.sections[i] for i in top)
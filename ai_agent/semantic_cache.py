@@ -0,0 +1,600 @@
+"""
+Семантический кэш для AI-агента.
+
+Хранит пары (вопрос, ответ) вместе с эмбеддингами вопросов в отдельной
+SQLite-базе рядом с основной БД. Перед обращением к LLM агент ищет
+семантически похожий вопрос (косинусная близость выше порога) и при
+попадании возвращает сохранённый ответ без запуска SQL-агента.
+
+Поиск выполняется через sqlite-vec (виртуальная таблица vec0), а при его
+отсутствии — перебором на numpy по сохранённым эмбеддингам.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Dict, Any, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger("ai_agent.semantic_cache")
+
+# Модель эмбеддингов: локальная MiniLM (384 измерения, ~8 мс на вопрос)
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+
+# В META_TABLE эмбеддинги хранятся в float16: вдвое меньше места и трафика
+# при сканировании; погрешность округления много ниже шума порога 0.9.
+# Старые fp32-блобы распознаются по длине и читаются прозрачно.
+_STORED_DTYPE = np.float16
+
+
+def _decode_embedding(blob: bytes) -> np.ndarray:
+    """Распаковать BLOB эмбеддинга (fp16 или legacy fp32) в float32."""
+    dtype = np.float16 if len(blob) == EMBEDDING_DIM * 2 else np.float32
+    return np.frombuffer(blob, dtype=dtype).astype(np.float32)
+
+try:
+    import sqlite_vec
+    SQLITE_VEC_AVAILABLE = True
+except ImportError:
+    sqlite_vec = None
+    SQLITE_VEC_AVAILABLE = False
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SentenceTransformer = None
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    faiss = None
+    FAISS_AVAILABLE = False
+
+# Порог, после которого точный IndexFlatIP меняется на HNSW: до ~10k
+# векторов линейный проход по 384-d укладывается в доли мс, дальше
+# включается O(log N) граф
+HNSW_UPGRADE_N = 10_000
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _topk_cosine_numba(mat, q, k):
+        """Скалярные произведения по строкам + top-k (вектора L2-нормированы)."""
+        n = mat.shape[0]
+        d = mat.shape[1]
+        sims = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            s = np.float32(0.0)
+            for j in range(d):
+                s += mat[i, j] * q[j]
+            sims[i] = s
+        idx = np.argsort(sims)[::-1][:k]
+        return idx, sims[idx]
+
+    # Прекомпиляция на фиктивных данных: первый реальный вопрос
+    # не платит за JIT (cache=True переживает перезапуски)
+    _topk_cosine_numba(
+        np.zeros((1, EMBEDDING_DIM), dtype=np.float32),
+        np.zeros(EMBEDDING_DIM, dtype=np.float32),
+        1,
+    )
+
+
+def topk_cosine(mat: np.ndarray, q: np.ndarray, k: int):
+    """
+    Топ-k косинусных близостей запроса к матрице эмбеддингов.
+
+    Вектора должны быть L2-нормированы (dot == cosine). При наличии numba
+    используется JIT-ядро с параллельным обходом строк, иначе - numpy
+    argpartition.
+
+    Args:
+        mat: Матрица (N, 384) float32
+        q: Вектор запроса (384,) float32
+        k: Сколько ближайших вернуть
+
+    Returns:
+        Кортеж (индексы, близости), отсортированный по убыванию близости
+    """
+    k = min(k, mat.shape[0])
+    if NUMBA_AVAILABLE:
+        return _topk_cosine_numba(mat, q, k)
+    sims = mat @ q
+    idx = np.argpartition(sims, -k)[-k:]
+    idx = idx[np.argsort(sims[idx])[::-1]]
+    return idx, sims[idx]
+
+
+try:
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+# Путь к экспортированной int8-модели MiniLM. Экспорт выполняется один раз:
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 minilm-onnx
+#   optimum-cli onnxruntime quantize --onnx_model minilm-onnx --avx512_vnni -o minilm-onnx-int8
+DEFAULT_ONNX_MODEL_PATH = str(Path(__file__).parent / "models" / "minilm-onnx-int8")
+
+
+class OnnxMiniLMEncoder:
+    """
+    MiniLM через ONNX Runtime (int8-квантование): ~2-3 мс на CPU против
+    ~8 мс у FP32 PyTorch, тот же encode()-интерфейс, что у SentenceTransformer.
+    """
+
+    def __init__(self, model_path: str):
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.intra_op_num_threads = max(1, (os.cpu_count() or 2) // 2)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_path,
+            provider="CPUExecutionProvider",
+            session_options=sess_options,
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = True,
+               convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        """Закодировать строку или список строк (mean pooling + L2-норма)."""
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        chunks = []
+        for i in range(0, len(batch), batch_size):
+            enc = self.tokenizer(
+                batch[i:i + batch_size],
+                padding=True, truncation=True, return_tensors="np",
+            )
+            hidden = self.model(**enc).last_hidden_state
+            mask = enc["attention_mask"][..., None].astype(hidden.dtype)
+            emb = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            chunks.append(emb)
+        emb = np.vstack(chunks).astype(np.float32)
+        if normalize_embeddings:
+            emb /= np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+        return emb[0] if single else emb
+
+
+_encoder = None
+_backend = "auto"
+_onnx_model_path = DEFAULT_ONNX_MODEL_PATH
+
+
+def set_embedding_backend(backend: str, onnx_model_path: Optional[str] = None) -> None:
+    """
+    Выбрать бэкенд эмбеддингов ('auto' | 'torch' | 'onnx').
+
+    'auto' использует ONNX int8, если onnxruntime установлен и модель
+    экспортирована, иначе PyTorch SentenceTransformer. Сбрасывает
+    текущий энкодер и LRU-кэш эмбеддингов.
+    """
+    global _encoder, _backend, _onnx_model_path
+    _backend = backend
+    if onnx_model_path:
+        _onnx_model_path = onnx_model_path
+    _encoder = None
+    _embed.cache_clear()
+
+
+def _onnx_model_ready() -> bool:
+    return ONNX_AVAILABLE and Path(_onnx_model_path).exists()
+
+
+def get_encoder():
+    """
+    Получить (лениво) общий экземпляр модели эмбеддингов.
+
+    Returns:
+        Энкодер с интерфейсом encode() или None, если ни один бэкенд
+        не доступен
+    """
+    global _encoder
+    if _encoder is not None:
+        return _encoder
+    use_onnx = (_backend == "onnx") or (_backend == "auto" and _onnx_model_ready())
+    if use_onnx and _onnx_model_ready():
+        logger.info(f"Загрузка ONNX int8 модели эмбеддингов: {_onnx_model_path}")
+        _encoder = OnnxMiniLMEncoder(_onnx_model_path)
+    elif SENTENCE_TRANSFORMERS_AVAILABLE:
+        logger.info(f"Загрузка модели эмбеддингов: {EMBEDDING_MODEL}")
+        _encoder = SentenceTransformer(EMBEDDING_MODEL)
+    return _encoder
+
+
+def encoder_available() -> bool:
+    """Доступен ли хоть один бэкенд эмбеддингов."""
+    return SENTENCE_TRANSFORMERS_AVAILABLE or _onnx_model_ready()
+
+
+# Размер LRU-кэша эмбеддингов по умолчанию (одинаковые вопросы - частый
+# случай: ретраи агента, опросы из дашборда)
+DEFAULT_EMBED_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=DEFAULT_EMBED_CACHE_SIZE)
+def _embed(question: str) -> Optional[Tuple[float, ...]]:
+    """
+    Посчитать эмбеддинг вопроса (мемоизировано по точной строке).
+
+    Возвращает кортеж (хэшируемый и безопасный для кэша), конвертация в
+    np.ndarray выполняется на месте вызова.
+    """
+    encoder = get_encoder()
+    if encoder is None:
+        return None
+    emb = encoder.encode(question, normalize_embeddings=True)
+    return tuple(np.asarray(emb, dtype=np.float32).tolist())
+
+
+def configure_embed_cache(maxsize: int) -> None:
+    """
+    Перенастроить размер LRU-кэша эмбеддингов.
+
+    Args:
+        maxsize: Новый максимальный размер кэша
+    """
+    global _embed
+    if maxsize != _embed.cache_info().maxsize:
+        _embed = lru_cache(maxsize=maxsize)(_embed.__wrapped__)
+
+
+def embed_cache_info():
+    """Статистика LRU-кэша эмбеддингов (для мониторинга hit-rate)."""
+    return _embed.cache_info()
+
+
+def embed_question(question: str) -> Optional[np.ndarray]:
+    """
+    Получить L2-нормированный эмбеддинг вопроса.
+
+    Args:
+        question: Вопрос на естественном языке
+
+    Returns:
+        np.ndarray формы (384,) float32 или None, если модель недоступна
+    """
+    emb = _embed(question)
+    if emb is None:
+        return None
+    return np.asarray(emb, dtype=np.float32)
+
+
+class _VectorCache:
+    """
+    Базовый класс: SQLite-хранилище (вопрос -> значение) с векторным поиском.
+
+    Схема (имена таблиц задаются подклассами):
+    - TABLE (vec0): embedding float[384], косинусная метрика
+    - META_TABLE: rowid, question, значение, ts
+
+    При недоступности sqlite-vec эмбеддинги хранятся BLOB'ом в META_TABLE,
+    а поиск идет перебором (скалярное произведение нормированных векторов).
+
+    Attributes:
+        cache_path: Путь к файлу кэша
+        threshold: Минимальная косинусная близость для попадания
+    """
+
+    TABLE = "qcache"
+    META_TABLE = "qcache_meta"
+    # Имя колонки со значением и ключ в результате lookup()
+    VALUE_COLUMN = "answer"
+
+    def __init__(self, cache_path: Union[str, Path], threshold: float = 0.9):
+        """
+        Инициализация кэша.
+
+        Args:
+            cache_path: Путь к SQLite-файлу кэша (создается при отсутствии)
+            threshold: Порог косинусной близости (0..1)
+        """
+        self.cache_path = Path(cache_path)
+        self.threshold = threshold
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._conn = sqlite3.connect(str(self.cache_path), check_same_thread=False)
+        self._vec_enabled = False
+
+        if SQLITE_VEC_AVAILABLE:
+            try:
+                self._conn.enable_load_extension(True)
+                sqlite_vec.load(self._conn)
+                self._conn.enable_load_extension(False)
+                self._vec_enabled = True
+            except Exception as e:
+                logger.warning(f"sqlite-vec недоступен, переход на перебор: {e}")
+
+        self._create_tables()
+
+        # Без sqlite-vec поиск идет через FAISS (если установлен):
+        # IndexFlatIP для малых кэшей, HNSW после HNSW_UPGRADE_N векторов
+        self._faiss_index = None
+        self._faiss_lock = threading.Lock()
+        if not self._vec_enabled and FAISS_AVAILABLE:
+            self._init_faiss()
+
+    def _create_tables(self):
+        """Создать таблицы кэша (идемпотентно)."""
+        cur = self._conn.cursor()
+        if self._vec_enabled:
+            cur.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.TABLE} "
+                f"USING vec0(embedding FLOAT[{EMBEDDING_DIM}] distance_metric=cosine)"
+            )
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.META_TABLE} ("
+            f"rowid INTEGER PRIMARY KEY, "
+            f"question TEXT NOT NULL, "
+            f"{self.VALUE_COLUMN} TEXT, "
+            f"embedding BLOB, "
+            f"ts REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _faiss_path(self) -> Path:
+        """Сайдкар-файл FAISS-индекса рядом с файлом кэша."""
+        return self.cache_path.with_name(f"{self.cache_path.name}.{self.TABLE}.faiss")
+
+    def _answered_rows(self):
+        """Строки с эмбеддингом и заполненным значением (для индексации)."""
+        return self._conn.execute(
+            f"SELECT rowid, embedding FROM {self.META_TABLE} "
+            f"WHERE embedding IS NOT NULL AND {self.VALUE_COLUMN} IS NOT NULL"
+        ).fetchall()
+
+    def _build_faiss(self, rows, hnsw: Optional[bool] = None):
+        """Построить IDMap-индекс (Flat или HNSW) по строкам кэша."""
+        if hnsw is None:
+            hnsw = len(rows) > HNSW_UPGRADE_N
+        if hnsw:
+            base = faiss.IndexHNSWFlat(EMBEDDING_DIM, 32, faiss.METRIC_INNER_PRODUCT)
+            base.hnsw.efConstruction = 200
+        else:
+            base = faiss.IndexFlatIP(EMBEDDING_DIM)
+        index = faiss.IndexIDMap2(base)
+        if rows:
+            mat = np.vstack([_decode_embedding(r[1]) for r in rows])
+            ids = np.asarray([r[0] for r in rows], dtype=np.int64)
+            index.add_with_ids(mat, ids)
+        return index
+
+    def _init_faiss(self) -> None:
+        """Загрузить сайдкар-индекс или перестроить его из SQLite."""
+        rows = self._answered_rows()
+        path = self._faiss_path()
+        index = None
+        if path.exists():
+            try:
+                index = faiss.read_index(str(path))
+                if index.ntotal != len(rows):
+                    index = None  # рассинхронизация с БД - перестроить
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать FAISS-индекс: {e}")
+                index = None
+        if index is None:
+            index = self._build_faiss(rows)
+            faiss.write_index(index, str(path))
+        self._faiss_index = index
+
+    def _faiss_add(self, rowid: int, emb: np.ndarray) -> None:
+        """Добавить вектор в индекс, при росте - мигрировать на HNSW."""
+        with self._faiss_lock:
+            self._faiss_index.add_with_ids(
+                emb.reshape(1, -1), np.asarray([rowid], dtype=np.int64)
+            )
+            ntotal = self._faiss_index.ntotal
+            faiss.write_index(self._faiss_index, str(self._faiss_path()))
+        needs_upgrade = ntotal > HNSW_UPGRADE_N and isinstance(
+            faiss.downcast_index(self._faiss_index.index), faiss.IndexFlatIP
+        )
+        if needs_upgrade:
+            # Миграция в фоне: поиск продолжает работать по Flat-индексу
+            threading.Thread(target=self._upgrade_to_hnsw, daemon=True).start()
+
+    def _upgrade_to_hnsw(self) -> None:
+        """Фоновая миграция Flat -> HNSW с атомарной подменой индекса."""
+        rows = self._answered_rows()
+        new_index = self._build_faiss(rows, hnsw=True)
+        with self._faiss_lock:
+            self._faiss_index = new_index
+            faiss.write_index(new_index, str(self._faiss_path()))
+        logger.info(f"FAISS-индекс {self.TABLE} мигрирован на HNSW ({len(rows)} векторов)")
+
+    def lookup(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Найти в кэше значение для семантически похожего вопроса.
+
+        Args:
+            question: Вопрос пользователя
+
+        Returns:
+            Словарь {question, <VALUE_COLUMN>, similarity} при попадании,
+            иначе None
+        """
+        emb = embed_question(question)
+        if emb is None:
+            return None
+
+        if self._vec_enabled:
+            # k=5: прогретые строки без значения не должны заслонять
+            # чуть более далекий, но отвеченный вопрос
+            candidates = [
+                (rowid, 1.0 - float(distance))
+                for rowid, distance in self._conn.execute(
+                    f"SELECT rowid, distance FROM {self.TABLE} "
+                    f"WHERE embedding MATCH ? AND k = 5 ORDER BY distance",
+                    (emb.tobytes(),),
+                )
+            ]
+        elif self._faiss_index is not None and self._faiss_index.ntotal > 0:
+            with self._faiss_lock:
+                sims, ids = self._faiss_index.search(emb.reshape(1, -1), 5)
+            candidates = [
+                (int(i), float(s)) for i, s in zip(ids[0], sims[0]) if i != -1
+            ]
+        else:
+            candidates = self._brute_force_lookup(emb)
+
+        for rowid, similarity in candidates:
+            if similarity < self.threshold:
+                break
+            meta = self._conn.execute(
+                f"SELECT question, {self.VALUE_COLUMN} FROM {self.META_TABLE} "
+                f"WHERE rowid = ? AND {self.VALUE_COLUMN} IS NOT NULL",
+                (rowid,),
+            ).fetchone()
+            if meta is not None:
+                return {
+                    "question": meta[0],
+                    self.VALUE_COLUMN: meta[1],
+                    "similarity": round(similarity, 4),
+                }
+        return None
+
+    def _brute_force_lookup(self, emb: np.ndarray):
+        """Линейный поиск ближайших вопросов по сохранённым эмбеддингам."""
+        rows = self._conn.execute(
+            f"SELECT rowid, embedding FROM {self.META_TABLE} "
+            f"WHERE embedding IS NOT NULL AND {self.VALUE_COLUMN} IS NOT NULL"
+        ).fetchall()
+        if not rows:
+            return []
+        ids = [r[0] for r in rows]
+        mat = np.vstack([_decode_embedding(r[1]) for r in rows])
+        idx, sims = topk_cosine(mat, emb, 5)
+        return [(ids[int(i)], float(s)) for i, s in zip(idx, sims)]
+
+    def add(self, question: str, value: str) -> None:
+        """
+        Сохранить пару (вопрос, значение) в кэш.
+
+        Args:
+            question: Вопрос пользователя
+            value: Сохраняемое значение (ответ, SQL и т.п.)
+        """
+        emb = embed_question(question)
+        if emb is None:
+            return
+        cur = self._conn.cursor()
+        # Прогретая строка с тем же вопросом - заполняем значение на месте
+        existing = cur.execute(
+            f"SELECT rowid FROM {self.META_TABLE} "
+            f"WHERE question = ? AND {self.VALUE_COLUMN} IS NULL",
+            (question,),
+        ).fetchone()
+        if existing is not None:
+            cur.execute(
+                f"UPDATE {self.META_TABLE} SET {self.VALUE_COLUMN} = ?, ts = ? "
+                f"WHERE rowid = ?",
+                (value, time.time(), existing[0]),
+            )
+            self._conn.commit()
+            if self._faiss_index is not None:
+                self._faiss_add(existing[0], emb)
+            return
+        cur.execute(
+            f"INSERT INTO {self.META_TABLE} "
+            f"(question, {self.VALUE_COLUMN}, embedding, ts) VALUES (?, ?, ?, ?)",
+            (question, value, emb.astype(_STORED_DTYPE).tobytes(), time.time()),
+        )
+        rowid = cur.lastrowid
+        if self._vec_enabled:
+            cur.execute(
+                f"INSERT INTO {self.TABLE} (rowid, embedding) VALUES (?, ?)",
+                (rowid, emb.tobytes()),
+            )
+        self._conn.commit()
+        if self._faiss_index is not None:
+            self._faiss_add(rowid, emb)
+
+    def warm(self, questions, batch_size: int = 32) -> int:
+        """
+        Прогреть кэш: батчево посчитать эмбеддинги для списка вопросов.
+
+        Вопросы записываются без значения (NULL) - lookup() их не отдает,
+        но эмбеддинг уже посчитан, и первое реальное обращение не платит
+        ни за кодирование, ни за холодный старт модели.
+
+        Args:
+            questions: Список вопросов (например, get_example_questions())
+            batch_size: Размер батча кодирования
+
+        Returns:
+            Количество добавленных вопросов
+        """
+        encoder = get_encoder()
+        if encoder is None or not questions:
+            return 0
+        known = {
+            row[0] for row in self._conn.execute(
+                f"SELECT question FROM {self.META_TABLE}"
+            )
+        }
+        new_questions = [q for q in questions if q not in known]
+        if not new_questions:
+            return 0
+        embeddings = encoder.encode(
+            new_questions,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        ).astype(np.float32)
+        cur = self._conn.cursor()
+        now = time.time()
+        for question, emb in zip(new_questions, embeddings):
+            cur.execute(
+                f"INSERT INTO {self.META_TABLE} (question, embedding, ts) "
+                f"VALUES (?, ?, ?)",
+                (question, emb.astype(_STORED_DTYPE).tobytes(), now),
+            )
+            if self._vec_enabled:
+                cur.execute(
+                    f"INSERT INTO {self.TABLE} (rowid, embedding) VALUES (?, ?)",
+                    (cur.lastrowid, emb.tobytes()),
+                )
+        self._conn.commit()
+        return len(new_questions)
+
+    def close(self) -> None:
+        """Закрыть соединение с кэшем."""
+        self._conn.close()
+
+
+class SemanticCache(_VectorCache):
+    """Семантический кэш вопрос-ответ (возвращает готовый ответ агента)."""
+
+    TABLE = "qcache"
+    META_TABLE = "qcache_meta"
+    VALUE_COLUMN = "answer"
+
+
+class PlanCache(_VectorCache):
+    """
+    Кэш SQL-планов: (эмбеддинг вопроса -> финальный SQL агента).
+
+    Позволяет для похожего вопроса пропустить ReAct-планирование и сразу
+    выполнить ранее найденный SQL, оставив LLM только форматирование ответа.
+    Порог строже, чем у кэша ответов: переиспользуется план, а не текст.
+    """
+
+    TABLE = "plancache"
+    META_TABLE = "plancache_meta"
+    VALUE_COLUMN = "sql"
+
+    def __init__(self, cache_path: Union[str, Path], threshold: float = 0.93):
+        super().__init__(cache_path, threshold=threshold)
@@ -0,0 +1,42 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# batch.py is written for flat imports from within ai_agent/ and pulls in
+# the langchain-backed agent module; skip when the agent stack is absent
+pytest.importorskip("langchain")
+
+AI_AGENT_DIR = Path(__file__).resolve().parents[1] / "ai_agent"
+if str(AI_AGENT_DIR) not in sys.path:
+    sys.path.insert(0, str(AI_AGENT_DIR))
+
+from batch import load_questions_from_file  # noqa: E402
+
+CONTENT = "# comment\nquestion one\n\n  question two  \nq with # hash\n"
+EXPECTED = ["question one", "question two", "q with # hash"]
+
+
+def test_load_questions_txt_lf(tmp_path):
+    f = tmp_path / "q.txt"
+    f.write_bytes(CONTENT.encode("utf-8"))
+    assert load_questions_from_file(str(f)) == EXPECTED
+
+
+def test_load_questions_txt_crlf(tmp_path):
+    # Windows-authored file: same questions, \r\n line endings
+    f = tmp_path / "q.txt"
+    f.write_bytes(CONTENT.replace("\n", "\r\n").encode("utf-8"))
+    assert load_questions_from_file(str(f)) == EXPECTED
+
+
+def test_load_questions_txt_no_final_newline(tmp_path):
+    f = tmp_path / "q.txt"
+    f.write_bytes(b"question one\r\nquestion two")
+    assert load_questions_from_file(str(f)) == ["question one", "question two"]
+
+
+def test_load_questions_txt_empty(tmp_path):
+    f = tmp_path / "q.txt"
+    f.write_bytes(b"")
+    assert load_questions_from_file(str(f)) == []
@@ -0,0 +1,56 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+
+AI_AGENT_DIR = Path(__file__).resolve().parents[1] / "ai_agent"
+if str(AI_AGENT_DIR) not in sys.path:
+    sys.path.insert(0, str(AI_AGENT_DIR))
+
+from canonical import CANONICAL_QUERIES, CanonicalQueryRouter  # noqa: E402
+
+
+@pytest.fixture()
+def engine():
+    # Minimal simulator-shaped fixture: statuses are stored lowercase
+    # (see module2_simulator), which is what the canonical SQL must match
+    eng = sqlalchemy.create_engine("sqlite://")
+    with eng.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE loan_issue (loan_id INTEGER, issue_date TEXT, "
+            "loan_amount REAL, interest_rate REAL)"
+        )
+        conn.exec_driver_sql(
+            "CREATE TABLE credit_fact_history (loan_id INTEGER, "
+            "period_month TEXT, status TEXT, DPD_bucket TEXT, "
+            "balance_principal REAL)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO loan_issue VALUES "
+            "(1, '2024-01-15', 100000, 12.5), (2, '2024-02-10', 200000, 11.0)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO credit_fact_history VALUES "
+            "(1, '2024-02-29', 'active', '0', 90000), "
+            "(2, '2024-02-29', 'active', '31-60', 180000), "
+            "(1, '2024-03-31', 'active', '0', 80000), "
+            "(2, '2024-03-31', 'active', '90+', 180000)"
+        )
+    return eng
+
+
+@pytest.mark.parametrize("intent", sorted(CANONICAL_QUERIES))
+def test_canonical_query_returns_rows(engine, intent):
+    with engine.connect() as conn:
+        rows = [tuple(r) for r in conn.execute(CANONICAL_QUERIES[intent]["sql"])]
+    assert rows, f"canonical query {intent} returned no rows"
+    assert any(v is not None for row in rows for v in row)
+
+
+@pytest.mark.parametrize("intent", sorted(CANONICAL_QUERIES))
+def test_canonical_execute_formats_data(engine, intent):
+    answer = CanonicalQueryRouter().execute(intent, engine)
+    assert CANONICAL_QUERIES[intent]["title"] in answer
+    assert "(нет данных)" not in answer
@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("streamlit")
+pd = pytest.importorskip("pandas")
+
+AI_AGENT_DIR = Path(__file__).resolve().parents[1] / "ai_agent"
+if str(AI_AGENT_DIR) not in sys.path:
+    sys.path.insert(0, str(AI_AGENT_DIR))
+
+from app_streamlit_advanced import _postprocess  # noqa: E402
+
+
+def test_postprocess_parses_full_iso_dates():
+    # period_month/cohort_month are written by the simulator as YYYY-MM-DD
+    df = _postprocess(pd.DataFrame({
+        "period_month": ["2024-02-29", "2024-03-31"],
+        "cohort_month": ["2024-01-01", "2024-02-01"],
+    }))
+    for col in ("period_month", "cohort_month"):
+        assert str(df[col].dtype).startswith("datetime64")
+        assert not df[col].isna().any()
+
+
+def test_postprocess_parses_year_month():
+    # month comes from substr(issue_date, 1, 7) => YYYY-MM
+    df = _postprocess(pd.DataFrame({"month": ["2010-01", "2010-02"]}))
+    assert str(df["month"].dtype).startswith("datetime64")
+    assert not df["month"].isna().any()
+
+
+def test_postprocess_categories():
+    df = _postprocess(pd.DataFrame({
+        "status": ["active", "default"],
+        "DPD_bucket": ["0", "90+"],
+    }))
+    assert str(df["status"].dtype) == "category"
+    assert str(df["DPD_bucket"].dtype) == "category"